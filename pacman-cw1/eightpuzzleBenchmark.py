@@ -0,0 +1,102 @@
+# eightpuzzleBenchmark.py
+#
+# Compares ways of solving eight puzzles on batches of eightpuzzle.createRandomEightPuzzle instances.
+#
+# Each solver plays the same seeded puzzles.  The A* solvers run search.aStarSearch with a heuristic, and lookup
+# follows the exact distance table straight to the goal.  Reports the time and the number of expansions per puzzle,
+# and checks that every solution is as short as the distance table says it can be.
+#
+# Like eightpuzzle.py itself, it imports search, which is not part of this tree: it needs a search.py with
+# aStarSearch, such as your solution to the search project, in this directory or on the PYTHONPATH.
+#
+#   python eightpuzzleBenchmark.py
+#   python eightpuzzleBenchmark.py -n 200 -m 40 -s manhattan,pattern,lookup
+#   PYTHONPATH=path/to/your/search/project python eightpuzzleBenchmark.py
+
+import random
+import sys
+import time
+
+import eightpuzzle
+import search
+
+
+# An EightPuzzleSearchProblem that counts the states it expands
+class CountingEightPuzzleProblem(eightpuzzle.EightPuzzleSearchProblem):
+
+    def __init__(self, puzzle):
+        eightpuzzle.EightPuzzleSearchProblem.__init__(self, puzzle)
+        self.expanded = 0
+
+    def getSuccessors(self, state):
+        self.expanded += 1
+        return eightpuzzle.EightPuzzleSearchProblem.getSuccessors(self, state)
+
+
+# The sum of the distances of the numbers 1 to 8 from their goal cells
+def manhattanHeuristic(state, problem=None):
+    cells = eightpuzzle.getCellsOfNumbers(state)
+    return sum([abs(cells[number] / 3 - number / 3) + abs(cells[number] % 3 - number % 3) for number in range(1, 9)])
+
+
+HEURISTICS = {'null': search.nullHeuristic,
+              'manhattan': manhattanHeuristic,
+              'pattern': eightpuzzle.eightPuzzlePatternHeuristic,
+              'exact': eightpuzzle.eightPuzzleDistanceHeuristic}
+
+
+# Returns the moves solverName finds for puzzle, and the number of states it expanded
+def solve(solverName, puzzle):
+    if solverName == 'lookup':
+        return eightpuzzle.getEightPuzzleDistances().solve(puzzle), 0
+    problem = CountingEightPuzzleProblem(puzzle)
+    return search.aStarSearch(problem, HEURISTICS[solverName]), problem.expanded
+
+
+# Solves every puzzle with the solver, returning the total time and expansions
+def benchmark(solverName, puzzles):
+    distances = eightpuzzle.getEightPuzzleDistances()
+    totalTime = 0.0
+    totalExpanded = 0
+    for puzzle in puzzles:
+        start = time.time()
+        moves, expanded = solve(solverName, puzzle)
+        totalTime += time.time() - start
+        totalExpanded += expanded
+        if len(moves) != distances.getDistance(puzzle):
+            raise Exception('%s found %d moves where %d will do' % (solverName, len(moves), distances.getDistance(puzzle)))
+    return totalTime, totalExpanded
+
+
+def readCommand(argv):
+    from optparse import OptionParser
+    parser = OptionParser("python eightpuzzleBenchmark.py <options>")
+    parser.add_option('-s', '--solvers', dest='solvers', default='manhattan,pattern,exact,lookup',
+                      help='Comma separated solvers to compare: %s or lookup [Default: %%default]' %
+                           ', '.join(sorted(HEURISTICS)))
+    parser.add_option('-n', '--numPuzzles', dest='numPuzzles', type='int', default=100,
+                      help='The number of puzzles to solve [Default: %default]')
+    parser.add_option('-m', '--moves', dest='moves', type='int', default=100,
+                      help='The number of random moves that make each puzzle [Default: %default]')
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+
+if __name__ == '__main__':
+    options = readCommand(sys.argv[1:])
+    random.seed('eightpuzzle')
+    puzzles = [eightpuzzle.createRandomEightPuzzle(options.moves) for i in range(options.numPuzzles)]
+
+    # Building the tables is a one-off, so it isn't counted against any solver
+    start = time.time()
+    eightpuzzle.getEightPuzzleDistances()
+    eightpuzzle.getPatternDatabases()
+    print 'Tables ready in %.2fs' % (time.time() - start)
+
+    print '%-12s %8s %12s %16s' % ('Solver', 'Puzzles', 'ms/puzzle', 'expanded/puzzle')
+    for solverName in options.solvers.split(','):
+        totalTime, totalExpanded = benchmark(solverName, puzzles)
+        print '%-12s %8d %12.3f %16.1f' % (solverName, len(puzzles), 1000 * totalTime / len(puzzles),
+                                           totalExpanded / float(len(puzzles)))
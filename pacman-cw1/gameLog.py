@@ -0,0 +1,325 @@
+# gameLog.py
+# ----------
+# Compact, append-only recordings of games, written while they are played.
+#
+# A recording starts with a header naming the layout by its fingerprint, the
+# number of agents and the random seed, if there was one.  Each move then
+# takes one varint, 1 + 5 * agentIndex + action, which is a single byte for
+# up to 25 agents.  Every checkpointEvery moves a checkpoint of the whole
+# state is written, and when the game ends an index of the checkpoints and
+# the final result are added, followed by a fixed-size trailer pointing at
+# them.  A recording that was never finished (the game crashed) still replays
+# up to where it stopped: it is just scanned from the start instead.
+#
+#   python pacman.py -p GreedyAgent -q -r          # records a game
+#   python pacman.py --replay recorded-game-1-...  # replays it
+#   python pacman.py --replay recorded-game-1-... --replayFrom 300
+
+import os
+import struct
+
+from game import AgentState
+from game import Configuration
+from game import Directions
+import layout as layoutModule
+
+MAGIC = 'PACLOG\x01\n'
+TRAILER = 'PEND'
+ACTIONS = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+ACTION_CODES = dict([(action, code) for code, action in enumerate(ACTIONS)])
+
+# The kinds of record that follow a 0 in the move stream
+CHECKPOINT = 0
+END = 1
+
+def isGameLog(fileName):
+    "Whether fileName is a recording in this format, rather than an old pickled one."
+    f = open(fileName, 'rb')
+    try: return f.read(len(MAGIC)) == MAGIC
+    finally: f.close()
+
+def loadGameLogs(paths):
+    """
+    Returns a GameLog for each recording among paths, which may name files or
+    directories of them.  Only the header and index of each are decoded, so a
+    corpus loads quickly; moves and states are decoded when they are asked for.
+    """
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            fileNames = [os.path.join(path, name) for name in sorted(os.listdir(path))]
+        else:
+            fileNames = [path]
+        for fileName in fileNames:
+            if os.path.isfile(fileName) and isGameLog(fileName): logs.append(GameLog(fileName))
+    return logs
+
+def writeVarint(out, value):
+    "Appends the unsigned LEB128 encoding of value to the bytearray out."
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def readVarint(data, offset):
+    "Returns the unsigned value encoded at offset in data and the offset after it."
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80: return value, offset
+        shift += 7
+
+def zigzag(value):
+    "Maps signed ints onto unsigned ones, keeping small magnitudes small."
+    if value < 0: return -2 * value - 1
+    return 2 * value
+
+def unzigzag(value):
+    if value & 1: return -(value + 1) / 2
+    return value / 2
+
+def packState(state):
+    """
+    Returns a bytearray holding everything about state that the rules use, so
+    that unpackState can rebuild it.  Positions are doubled, since scared
+    ghosts move half a square at a time.
+    """
+    data = state.data
+    out = bytearray()
+    writeVarint(out, zigzag(int(data.score)))
+    writeVarint(out, int(data._win) | int(data._lose) << 1)
+    writeVarint(out, data.food.bits)
+    writeVarint(out, len(data.capsules))
+    for x, y in data.capsules:
+        writeVarint(out, x)
+        writeVarint(out, y)
+    for agentState in data.agentStates:
+        configuration = agentState.configuration
+        x, y = configuration.getPosition()
+        writeVarint(out, int(x * 2))
+        writeVarint(out, int(y * 2))
+        writeVarint(out, ACTION_CODES[configuration.getDirection()])
+        writeVarint(out, agentState.scaredTimer)
+    return out
+
+def unpackState(packed, initialState):
+    """
+    Returns a copy of initialState, the start of the game, with the state
+    packed by packState in its place.
+    """
+    state = initialState.deepCopy()
+    data = state.data
+    score, offset = readVarint(packed, 0)
+    data.score = unzigzag(score)
+    flags, offset = readVarint(packed, offset)
+    data._win, data._lose = bool(flags & 1), bool(flags & 2)
+    data.food.bits, offset = readVarint(packed, offset)
+    numCapsules, offset = readVarint(packed, offset)
+    data.capsules = []
+    for i in range(numCapsules):
+        x, offset = readVarint(packed, offset)
+        y, offset = readVarint(packed, offset)
+        data.capsules.append((x, y))
+    for index, agentState in enumerate(data.agentStates):
+        x, offset = readVarint(packed, offset)
+        y, offset = readVarint(packed, offset)
+        direction, offset = readVarint(packed, offset)
+        scaredTimer, offset = readVarint(packed, offset)
+        restored = AgentState(agentState.start, agentState.isPacman)
+        restored.configuration = Configuration((_halve(x), _halve(y)), ACTIONS[direction])
+        restored.scaredTimer = scaredTimer
+        data.agentStates[index] = restored
+    data._zobrist = None
+    data.getZobristKey()
+    return state
+
+def _halve(doubled):
+    "Undoes the doubling of a coordinate, giving an int where it was one."
+    if doubled % 2: return doubled / 2.0
+    return doubled / 2
+
+class GameLogWriter:
+    """
+    Writes a recording of one game as it is played.  The Game calls record
+    after every move, and whoever started the game calls close once it is over.
+    """
+    def __init__(self, fileName, layout, numAgents, seed=None, checkpointEvery=64):
+        self.file = open(fileName, 'wb')
+        self.checkpointEvery = checkpointEvery
+        self.turn = 0
+        self.checkpoints = []
+        self.offset = 0
+        header = bytearray(MAGIC)
+        header += layout.getFingerprint()
+        writeVarint(header, numAgents)
+        writeVarint(header, checkpointEvery)
+        seed = seed != None and repr(seed) or ''
+        writeVarint(header, len(seed))
+        header += seed
+        self.write(header)
+
+    def write(self, data):
+        self.file.write(data)
+        self.offset += len(data)
+
+    def record(self, agentIndex, action, state):
+        "Records that agentIndex took action, leaving the game in state."
+        code = 1 + 5 * agentIndex + ACTION_CODES[action]
+        if code < 0x80:
+            self.file.write(chr(code))
+            self.offset += 1
+        else:
+            out = bytearray()
+            writeVarint(out, code)
+            self.write(out)
+        self.turn += 1
+        if self.turn % self.checkpointEvery == 0: self.checkpoint(state)
+
+    def checkpoint(self, state):
+        packed = packState(state)
+        out = bytearray([0])
+        writeVarint(out, CHECKPOINT)
+        writeVarint(out, self.turn)
+        writeVarint(out, len(packed))
+        self.checkpoints.append((self.turn, self.offset))
+        self.write(out + packed)
+        self.file.flush()
+
+    def close(self, state):
+        "Writes the result of the game in its final state and the index, and closes the file."
+        end = self.offset
+        out = bytearray([0])
+        writeVarint(out, END)
+        writeVarint(out, self.turn)
+        writeVarint(out, zigzag(int(state.data.score)))
+        writeVarint(out, int(state.data._win) | int(state.data._lose) << 1)
+        writeVarint(out, len(self.checkpoints))
+        for turn, offset in self.checkpoints:
+            writeVarint(out, turn)
+            writeVarint(out, offset)
+        self.write(out)
+        self.write(struct.pack('<Q', end) + TRAILER)
+        self.file.close()
+
+class GameLog:
+    """
+    A recording read back from a file.
+
+    The header and the index are decoded straight away.  getMoves decodes the
+    whole move stream, and getState finds the state at any turn by unpacking
+    the checkpoint before it and playing on from there.
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        f = open(fileName, 'rb')
+        try: self.data = bytearray(f.read())
+        finally: f.close()
+        if self.data[:len(MAGIC)] != MAGIC: raise Exception('%s is not a recorded game' % fileName)
+        offset = len(MAGIC)
+        self.fingerprint = str(self.data[offset:offset + 16])
+        numAgents, offset = readVarint(self.data, offset + 16)
+        self.numAgents = numAgents
+        self.checkpointEvery, offset = readVarint(self.data, offset)
+        length, offset = readVarint(self.data, offset)
+        self.seed = str(self.data[offset:offset + length]) or None
+        self.start = offset + length
+        self.moves = None
+        self.layout = None
+        self.initialState = None
+
+        # (turn, offset) of each checkpoint
+        self.checkpoints = []
+        self.finished = str(self.data[-len(TRAILER):]) == TRAILER
+        if self.finished:
+            self.end = struct.unpack('<Q', str(self.data[-len(TRAILER) - 8:-len(TRAILER)]))[0]
+            kind, offset = readVarint(self.data, self.end + 1)
+            self.turns, offset = readVarint(self.data, offset)
+            score, offset = readVarint(self.data, offset)
+            self.score = unzigzag(score)
+            flags, offset = readVarint(self.data, offset)
+            self.win, self.lose = bool(flags & 1), bool(flags & 2)
+            numCheckpoints, offset = readVarint(self.data, offset)
+            for i in range(numCheckpoints):
+                turn, offset = readVarint(self.data, offset)
+                checkpoint, offset = readVarint(self.data, offset)
+                self.checkpoints.append((turn, checkpoint))
+        else:
+            # Unfinished games have no index or result: find what there is by scanning
+            self.end = len(self.data)
+            self.getMoves()
+            self.turns = len(self.moves)
+            self.score = None
+            self.win = self.lose = False
+
+    def getMoves(self):
+        "Returns the (agentIndex, action) of every move, like Game.moveHistory."
+        if self.moves != None: return self.moves
+        data, offset, end = self.data, self.start, self.end
+        moves = []
+        checkpoints = []
+        while offset < end:
+            code = data[offset]
+            if code >= 0x80:
+                code, next = readVarint(data, offset)
+            else:
+                next = offset + 1
+            if code == 0:
+                kind, next = readVarint(data, next)
+                if kind != CHECKPOINT: break
+                turn, next = readVarint(data, next)
+                length, next = readVarint(data, next)
+                # A checkpoint cut short by a crash is left out
+                if next + length > end: break
+                checkpoints.append((turn, offset))
+                next += length
+            else:
+                agentIndex, action = divmod(code - 1, 5)
+                moves.append((agentIndex, ACTIONS[action]))
+            offset = next
+        self.moves = moves
+        if not self.finished: self.checkpoints = checkpoints
+        return moves
+
+    def getLayout(self):
+        "Returns the layout the game was played on, found by its fingerprint."
+        if self.layout == None:
+            self.layout = layoutModule.findLayout(self.fingerprint)
+            if self.layout == None: raise Exception('The layout of %s cannot be found' % self.fileName)
+        return self.layout
+
+    def getInitialState(self):
+        if self.initialState == None:
+            import pacman
+            self.initialState = pacman.GameState()
+            self.initialState.initialize(self.getLayout(), self.numAgents - 1)
+        return self.initialState
+
+    def getState(self, turn):
+        """
+        Returns the GameState after the first turn moves, starting from the
+        last checkpoint at or before it rather than from the start.
+        """
+        turn = min(turn, self.turns)
+        moves = self.getMoves()
+        last = None
+        for checkpoint in self.checkpoints:
+            if checkpoint[0] > turn: break
+            last = checkpoint
+        if last == None:
+            start, state = 0, self.getInitialState()
+        else:
+            start, offset = last
+            state = unpackState(self.readCheckpoint(offset), self.getInitialState())
+        for agentIndex, action in moves[start:turn]:
+            state = state.generateSuccessor(agentIndex, action)
+        return state
+
+    def readCheckpoint(self, offset):
+        "Returns the packed state of the checkpoint at offset."
+        kind, offset = readVarint(self.data, offset + 1)
+        turn, offset = readVarint(self.data, offset)
+        length, offset = readVarint(self.data, offset)
+        return self.data[offset:offset + length]
@@ -64,7 +64,7 @@ class DirectionalGhost( GhostAgent ):
         pacmanPosition = state.getPacmanPosition()
 
         # Select best actions given the state
-        distancesToPacman = [manhattanDistance( pos, pacmanPosition ) for pos in newPositions]
+        distancesToPacman = [self.distance( state, pos, pacmanPosition ) for pos in newPositions]
         if isScared:
             bestScore = max( distancesToPacman )
             bestProb = self.prob_scaredFlee
@@ -79,3 +79,11 @@ class DirectionalGhost( GhostAgent ):
         for a in legalActions: dist[a] += ( 1-bestProb ) / len(legalActions)
         dist.normalize()
         return dist
+
+    def distance( self, state, pos, pacmanPosition ):
+        return manhattanDistance( pos, pacmanPosition )
+
+class MazeDirectionalGhost( DirectionalGhost ):
+    "A DirectionalGhost that measures its distance to Pacman along the maze, rather than as the crow flies."
+    def distance( self, state, pos, pacmanPosition ):
+        return state.getMazeDistance( pos, pacmanPosition )
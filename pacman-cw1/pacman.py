@@ -43,16 +43,25 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
+from game import Configuration
 from util import nearestPoint
 from util import manhattanDistance
 import util, layout
-import sys, types, time, random, os
+import sys, types, time, random, os, math, array, collections
 
 ###################################################
 # YOUR INTERFACE TO THE PACMAN WORLD: A GameState #
 ###################################################
 
-class GameState:
+class ExploredStates(object):
+    """
+    GameState.explored: the set of explored states GameState.exploration keeps
+    in 'set' mode, whether it is read from the class or from a state.
+    """
+    def __get__( self, state, stateClass ):
+        return stateClass.exploration.states
+
+class GameState(object):
     """
     A GameState specifies the full game state, including the food, capsules,
     agent configurations and score changes.
@@ -66,19 +75,47 @@ class GameState:
 
     Note that in classic Pacman, Pacman is always agent 0.
     """
+    __slots__ = ('data',)
 
     ####################################################
     # Accessor methods: use these to access state data #
     ####################################################
 
-    # static variable keeps track of which states have had getLegalActions called
-    explored = set()
+    # static variable keeps track of the states generateSuccessor has been
+    # called on and has returned, if switched on (see setExploration)
+    exploration = util.ExplorationCounter()
+    explored = ExploredStates()
+    warnedUntracked = False
     def getAndResetExplored():
-        tmp = GameState.explored.copy()
-        GameState.explored = set()
+        """
+        Returns the set of states explored since the last call.  The states are
+        only kept in 'set' mode, so in any other mode this warns, the first
+        time, that the set it returns is empty because nothing was kept.
+        """
+        if GameState.exploration.mode != 'set' and not GameState.warnedUntracked:
+            print >>sys.stderr, "Warning: explored states are not being kept (exploration mode '%s'), so none are " \
+                                "returned. Call GameState.setExploration('set') first, or run with --explored set." \
+                                % GameState.exploration.mode
+            GameState.warnedUntracked = True
+        tmp = GameState.exploration.states.copy()
+        GameState.exploration.reset()
         return tmp
     getAndResetExplored = staticmethod(getAndResetExplored)
 
+    def setExploration( mode, cap=None ):
+        """
+        Switches exploration tracking to one of the modes of
+        util.ExplorationCounter: 'off' (the default), 'count', 'set' or
+        'estimate'.  Grading code that needs the exact set of explored states
+        should use 'set'.
+        """
+        GameState.exploration = util.ExplorationCounter( mode, cap )
+    setExploration = staticmethod(setExploration)
+
+    def getExplorationMetrics():
+        return GameState.exploration.getMetrics()
+    getExplorationMetrics = staticmethod(getExplorationMetrics)
+
     def getLegalActions( self, agentIndex=0 ):
         """
         Returns the legal actions for the agent specified.
@@ -103,7 +140,8 @@ class GameState:
 
         # Let agent's logic deal with its action's effects on the board
         if agentIndex == 0:  # Pacman is moving
-            state.data._eaten = [False for i in range(state.getNumAgents())]
+            if True in state.data._eaten:
+                state.data._eaten = [False for i in range(state.getNumAgents())]
             PacmanRules.applyAction( state, action )
         else:                # A ghost is moving
             GhostRules.applyAction( state, action, agentIndex )
@@ -112,7 +150,10 @@ class GameState:
         if agentIndex == 0:
             state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
         else:
+            # GhostRules.applyAction has already made this ghost's AgentState a copy
+            state.data.toggleAgentKey( agentIndex )
             GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+            state.data.toggleAgentKey( agentIndex )
 
         # Resolve multi-agent effects
         GhostRules.checkDeath( state, agentIndex )
@@ -120,8 +161,7 @@ class GameState:
         # Book keeping
         state.data._agentMoved = agentIndex
         state.data.score += state.data.scoreChange
-        GameState.explored.add(self)
-        GameState.explored.add(state)
+        GameState.exploration.explore(self, state)
         return state
 
     def getLegalPacmanActions( self ):
@@ -200,8 +240,23 @@ class GameState:
         """
         return self.data.layout.walls
 
+    def getMazeDistance(self, pos1, pos2):
+        """
+        Returns the length of the shortest path between two positions through the
+        maze, looked up in a table precomputed once per layout (see layout.py).
+        """
+        return self.data.layout.getMazeDistances().getDistance(pos1, pos2)
+
+    def getVisibleCells(self, pos, direction, limit=None):
+        """
+        Returns the set of squares that can be seen from pos looking along
+        direction, up to the first wall and no more than limit squares away.
+        The sets come from an index built once per layout (see layout.py).
+        """
+        return self.data.layout.getVisibility().getVisibleCells(pos, direction, limit)
+
     def hasFood(self, x, y):
-        return self.data.food[x][y]
+        return self.data.food.get(x, y)
 
     def hasWall(self, x, y):
         return self.data.layout.walls[x][y]
@@ -227,7 +282,7 @@ class GameState:
             self.data = GameStateData()
 
     def deepCopy( self ):
-        state = GameState( self )
+        state = GameState()
         state.data = self.data.deepCopy()
         return state
 
@@ -253,6 +308,153 @@ class GameState:
         """
         self.data.initialize(layout, numGhostAgents)
 
+class SearchState(GameState):
+    """
+    A GameState for tree search that is changed in place rather than copied.
+
+    apply(action) makes the move of the agent whose turn it is, agentIndex,
+    and passes the turn on.  undo() takes back the last move applied.  Each
+    move only saves what it changes (the food or capsule eaten, the agents it
+    moved, scared or sent home, and the score and win/lose flags), so
+    searching a long line of moves allocates almost nothing.  The Zobrist key
+    is kept up to date too, so hashing a search state takes constant time.  The resulting
+    states are equal to the ones generateSuccessor makes, and all the
+    GameState accessors can be used on them as usual.
+
+    Unlike generateSuccessor, apply doesn't check that the action is legal,
+    doesn't record states in GameState.exploration, and doesn't keep the fields that
+    are only there for the display (_foodEaten, _eaten and so on).
+    """
+    __slots__ = ('agentIndex', 'history')
+
+    def __init__( self, state, agentIndex=0 ):
+        GameState.__init__( self )
+        self.data = state.data.deepCopy()
+        self.agentIndex = agentIndex
+        self.history = []
+
+    def getLegalActions( self, agentIndex=None ):
+        """
+        Returns the legal actions for the agent specified, by default the one
+        whose turn it is.
+        """
+        if agentIndex == None: agentIndex = self.agentIndex
+        if self.isWin() or self.isLose(): return []
+        if agentIndex == 0:
+            return PacmanRules.getLegalActions( self )
+        return GhostRules.getLegalActions( self, agentIndex )
+
+    def generateSuccessor( self, agentIndex, action ):
+        """
+        Returns the successor state after the specified agent takes the action,
+        as a GameState that shares nothing with this one, which apply changes
+        in place.
+        """
+        return self.deepCopy().generateSuccessor( agentIndex, action )
+
+    def apply( self, action ):
+        """
+        Makes the move of the agent whose turn it is, then passes the turn on.
+        """
+        data = self.data
+        if data._win or data._lose: raise Exception('Can\'t generate a successor of a terminal state.')
+        agentIndex = self.agentIndex
+        agentStates = data.agentStates
+        # (index, configuration, scaredTimer) of each agent before it changed
+        changed = []
+        eatenFood = None
+        eatenCapsule = None
+        score, win, lose, key = data.score, data._win, data._lose, data._zobrist
+        scoreChange = 0
+
+        agentState = agentStates[agentIndex]
+        changed.append( (agentIndex, agentState.configuration, agentState.scaredTimer) )
+        data.toggleAgentKey( agentIndex )
+        if agentIndex == 0:
+            agentState.configuration = agentState.configuration.generateSuccessor(
+                Actions.directionToVector( action, PacmanRules.PACMAN_SPEED ) )
+
+            # Eat
+            next = agentState.configuration.getPosition()
+            nearest = nearestPoint( next )
+            if manhattanDistance( nearest, next ) <= 0.5:
+                x, y = nearest
+                if data.food.get(x, y):
+                    scoreChange += 10
+                    data.food.set(x, y, False)
+                    data.toggleFoodKey( nearest )
+                    eatenFood = nearest
+                    if data.food.count() == 0 and not data._lose:
+                        scoreChange += 500
+                        data._win = True
+                if nearest in data.capsules:
+                    eatenCapsule = (data.capsules.index( nearest ), nearest)
+                    data.capsules.remove( nearest )
+                    data.toggleCapsuleKey( nearest )
+                    for index in range( 1, len( agentStates ) ):
+                        ghostState = agentStates[index]
+                        changed.append( (index, ghostState.configuration, ghostState.scaredTimer) )
+                        data.toggleAgentKey( index )
+                        ghostState.scaredTimer = SCARED_TIME
+                        data.toggleAgentKey( index )
+            data.toggleAgentKey( 0 )
+            scoreChange -= TIME_PENALTY
+            colliding = range( 1, len( agentStates ) )
+        else:
+            speed = GhostRules.GHOST_SPEED
+            if agentState.scaredTimer > 0: speed /= 2.0
+            agentState.configuration = agentState.configuration.generateSuccessor(
+                Actions.directionToVector( action, speed ) )
+
+            # Time passes
+            if agentState.scaredTimer == 1:
+                configuration = agentState.configuration
+                agentState.configuration = Configuration( nearestPoint( configuration.pos ), configuration.direction )
+            agentState.scaredTimer = max( 0, agentState.scaredTimer - 1 )
+            data.toggleAgentKey( agentIndex )
+            colliding = [agentIndex]
+
+        # Resolve multi-agent effects
+        pacmanPosition = agentStates[0].configuration.getPosition()
+        for index in colliding:
+            ghostState = agentStates[index]
+            if GhostRules.canKill( pacmanPosition, ghostState.configuration.getPosition() ):
+                if ghostState.scaredTimer > 0:
+                    changed.append( (index, ghostState.configuration, ghostState.scaredTimer) )
+                    scoreChange += 200
+                    data.toggleAgentKey( index )
+                    ghostState.configuration = ghostState.start
+                    ghostState.scaredTimer = 0
+                    data.toggleAgentKey( index )
+                elif not data._win:
+                    scoreChange -= 500
+                    data._lose = True
+
+        data.score += scoreChange
+        self.history.append( (agentIndex, score, win, lose, key, changed, eatenFood, eatenCapsule) )
+        self.agentIndex = (agentIndex + 1) % len( agentStates )
+
+    def undo( self ):
+        """
+        Takes back the last move made by apply.
+        """
+        agentIndex, score, win, lose, key, changed, eatenFood, eatenCapsule = self.history.pop()
+        data = self.data
+        agentStates = data.agentStates
+        for index, configuration, scaredTimer in reversed( changed ):
+            agentStates[index].configuration = configuration
+            agentStates[index].scaredTimer = scaredTimer
+        if eatenFood != None:
+            x, y = eatenFood
+            data.food.set(x, y, True)
+        if eatenCapsule != None:
+            data.capsules.insert( *eatenCapsule )
+        data.score = score
+        data._win = win
+        data._lose = lose
+        data._zobrist = key
+        self.agentIndex = agentIndex
+
 ############################################################################
 #                     THE HIDDEN SECRETS OF PACMAN                         #
 #                                                                          #
@@ -331,7 +533,11 @@ class PacmanRules:
         """
         Returns a list of possible actions.
         """
-        return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+        configuration = state.data.agentStates[0].configuration
+        actions = state.data.layout.getMoveTables().actions.get( configuration.pos )
+        if actions == None:
+            return Actions.getPossibleActions( configuration, state.data.layout.walls )
+        return list( actions )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action ):
@@ -342,11 +548,13 @@ class PacmanRules:
         if action not in legal:
             raise Exception("Illegal action " + str(action))
 
-        pacmanState = state.data.agentStates[0]
+        pacmanState = state.data.updateAgentState( 0 )
 
         # Update Configuration
         vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
+        state.data.toggleAgentKey( 0 )
         pacmanState.configuration = pacmanState.configuration.generateSuccessor( vector )
+        state.data.toggleAgentKey( 0 )
 
         # Eat
         next = pacmanState.configuration.getPosition()
@@ -359,10 +567,11 @@ class PacmanRules:
     def consume( position, state ):
         x,y = position
         # Eat food
-        if state.data.food[x][y]:
+        if state.data.food.get(x, y):
             state.data.scoreChange += 10
             state.data.food = state.data.food.copy()
-            state.data.food[x][y] = False
+            state.data.food.set(x, y, False)
+            state.data.toggleFoodKey( position )
             state.data._foodEaten = position
             # TODO: cache numFood?
             numFood = state.getNumFood()
@@ -371,11 +580,16 @@ class PacmanRules:
                 state.data._win = True
         # Eat capsule
         if( position in state.getCapsules() ):
+            # The list may be shared with other states
+            state.data.capsules = state.data.capsules[:]
             state.data.capsules.remove( position )
+            state.data.toggleCapsuleKey( position )
             state.data._capsuleEaten = position
             # Reset all ghosts' scared timers
             for index in range( 1, len( state.data.agentStates ) ):
-                state.data.agentStates[index].scaredTimer = SCARED_TIME
+                state.data.toggleAgentKey( index )
+                state.data.updateAgentState( index ).scaredTimer = SCARED_TIME
+                state.data.toggleAgentKey( index )
     consume = staticmethod( consume )
 
 class GhostRules:
@@ -389,13 +603,11 @@ class GhostRules:
         reach a dead end, but can turn 90 degrees at intersections.
         """
         conf = state.getGhostState( ghostIndex ).configuration
-        possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
-        reverse = Actions.reverseDirection( conf.direction )
-        if Directions.STOP in possibleActions:
-            possibleActions.remove( Directions.STOP )
-        if reverse in possibleActions and len( possibleActions ) > 1:
-            possibleActions.remove( reverse )
-        return possibleActions
+        actions = state.data.layout.getMoveTables().ghostActions.get( (conf.pos, conf.direction) )
+        if actions == None:
+            # Between squares, or on the edge of the board
+            return Actions.ghostActions( Actions.getPossibleActions( conf, state.data.layout.walls ), conf.direction )
+        return list( actions )
     getLegalActions = staticmethod( getLegalActions )
 
     def applyAction( state, action, ghostIndex):
@@ -404,17 +616,21 @@ class GhostRules:
         if action not in legal:
             raise Exception("Illegal ghost action " + str(action))
 
-        ghostState = state.data.agentStates[ghostIndex]
+        ghostState = state.data.updateAgentState( ghostIndex )
         speed = GhostRules.GHOST_SPEED
         if ghostState.scaredTimer > 0: speed /= 2.0
         vector = Actions.directionToVector( action, speed )
+        state.data.toggleAgentKey( ghostIndex )
         ghostState.configuration = ghostState.configuration.generateSuccessor( vector )
+        state.data.toggleAgentKey( ghostIndex )
     applyAction = staticmethod( applyAction )
 
     def decrementTimer( ghostState):
         timer = ghostState.scaredTimer
         if timer == 1:
-            ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+            # A new configuration, as the old one may be shared with other states
+            configuration = ghostState.configuration
+            ghostState.configuration = Configuration( nearestPoint( configuration.pos ), configuration.direction )
         ghostState.scaredTimer = max( 0, timer - 1 )
     decrementTimer = staticmethod( decrementTimer )
 
@@ -436,10 +652,15 @@ class GhostRules:
     def collide( state, ghostState, agentIndex):
         if ghostState.scaredTimer > 0:
             state.data.scoreChange += 200
+            state.data.toggleAgentKey( agentIndex )
+            ghostState = state.data.updateAgentState( agentIndex )
             GhostRules.placeGhost(state, ghostState)
             ghostState.scaredTimer = 0
+            state.data.toggleAgentKey( agentIndex )
             # Added for first-person
-            state.data._eaten[agentIndex] = True
+            eaten = list( state.data._eaten )
+            eaten[agentIndex] = True
+            state.data._eaten = eaten
         else:
             if not state.data._win:
                 state.data.scoreChange -= 500
@@ -512,7 +733,9 @@ def readCommand( argv ):
     parser.add_option('-r', '--recordActions', action='store_true', dest='record',
                       help='Writes game histories to a file (named by the time they were played)', default=False)
     parser.add_option('--replay', dest='gameToReplay',
-                      help='A recorded game file (pickle) to replay', default=None)
+                      help='A recorded game file to replay', default=None)
+    parser.add_option('--replayFrom', dest='replayFrom', type='int',
+                      help=default('The move to start a replay from'), metavar='TURN', default=0)
     parser.add_option('-a','--agentArgs',dest='agentArgs',
                       help='Comma separated values sent to agent. e.g. "opt1=val1,opt2,opt3=val3"')
     parser.add_option('-x', '--numTraining', dest='numTraining', type='int',
@@ -521,8 +744,17 @@ def readCommand( argv ):
                       help=default('Time to delay between frames; <0 means keyboard'), default=0.1)
     parser.add_option('-c', '--catchExceptions', action='store_true', dest='catchExceptions',
                       help='Turns on exception handling and timeouts during games', default=False)
-    parser.add_option('--timeout', dest='timeout', type='int',
+    parser.add_option('--timeout', dest='timeout', type='float',
                       help=default('Maximum length of time an agent can spend computing in a single game'), default=30)
+    parser.add_option('--explored', dest='explored', type='choice', choices=util.ExplorationCounter.MODES,
+                      help=default('Keep track of the states explored: off, count, set or estimate'), default='off')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int',
+                      help='Play the games without graphics across JOBS worker processes (0 means one per core)', default=None)
+    parser.add_option('--seed', dest='seed', type='int',
+                      help='With --jobs, game i is seeded with (SEED, i) so the same batch can be played again', default=None)
+    parser.add_option('--results', dest='resultsFile',
+                      help='Writes the result of each game to FILE, as CSV if it ends in .csv and JSON lines otherwise',
+                      metavar='FILE', default=None)
 
     options, otherjunk = parser.parse_args(argv)
     if len(otherjunk) != 0:
@@ -532,12 +764,15 @@ def readCommand( argv ):
     # Fix the random seed
     if options.fixRandomSeed: random.seed('cs188')
 
+    GameState.setExploration( options.explored )
+
     # Choose a layout
     args['layout'] = layout.getLayout( options.layout )
     if args['layout'] == None: raise Exception("The layout " + options.layout + " cannot be found")
 
     # Choose a Pacman agent
-    noKeyboard = options.gameToReplay == None and (options.textGraphics or options.quietGraphics)
+    headless = options.quietGraphics or options.jobs != None
+    noKeyboard = options.gameToReplay == None and (options.textGraphics or headless)
     pacmanType = loadAgent(options.pacman, noKeyboard)
     agentOpts = parseAgentArgs(options.agentArgs)
     if options.numTraining > 0:
@@ -556,7 +791,7 @@ def readCommand( argv ):
     args['ghosts'] = [ghostType( i+1 ) for i in range( options.numGhosts )]
 
     # Choose a display format
-    if options.quietGraphics:
+    if headless:
         import textDisplay
         args['display'] = textDisplay.NullGraphics()
     elif options.textGraphics:
@@ -570,14 +805,35 @@ def readCommand( argv ):
     args['record'] = options.record
     args['catchExceptions'] = options.catchExceptions
     args['timeout'] = options.timeout
+    args['resultsFile'] = options.resultsFile
+    if options.jobs != None:
+        args['jobs'] = options.jobs
+        args['seed'] = options.seed
+    else:
+        # Nothing looks at the games once they have been summarised
+        args['keepGames'] = 0
 
     # Special case: recorded games don't use the runGames method or args structure
     if options.gameToReplay != None:
         print 'Replaying recorded game %s.' % options.gameToReplay
-        import cPickle
-        f = open(options.gameToReplay)
-        try: recorded = cPickle.load(f)
-        finally: f.close()
+        import cPickle, gameLog
+        if gameLog.isGameLog(options.gameToReplay):
+            log = gameLog.GameLog(options.gameToReplay)
+            recorded = {'layout': log.getLayout(), 'actions': log.getMoves()[options.replayFrom:],
+                        'state': log.getState(options.replayFrom)}
+        else:
+            # Games recorded before gameLog were pickled whole
+            f = open(options.gameToReplay)
+            try: recorded = cPickle.load(f)
+            finally: f.close()
+            # with a Layout that may be out of date, and are played up to the turn to replay from
+            recorded['layout'] = layout.Layout( recorded['layout'].layoutText )
+            state = GameState()
+            state.initialize( recorded['layout'], recorded['layout'].getNumGhosts() )
+            for action in recorded['actions'][:options.replayFrom]:
+                state = state.generateSuccessor( *action )
+            recorded['actions'] = recorded['actions'][options.replayFrom:]
+            recorded['state'] = state
         recorded['display'] = args['display']
         replayGame(**recorded)
         sys.exit(0)
@@ -607,11 +863,16 @@ def loadAgent(pacman, nographics):
                 return getattr(module, pacman)
     raise Exception('The agent ' + pacman + ' is not specified in any *Agents.py.')
 
-def replayGame( layout, actions, display ):
+def replayGame( layout, actions, display, state=None ):
+    """
+    Shows the moves in actions being played on layout, from the start of the
+    game or from state if given.
+    """
     import pacmanAgents, ghostAgents
     rules = ClassicGameRules()
     agents = [pacmanAgents.GreedyAgent()] + [ghostAgents.RandomGhost(i+1) for i in range(layout.getNumGhosts())]
     game = rules.newGame( layout, agents[0], agents[1:], display )
+    if state != None: game.state = state
     state = game.state
     display.initialize(state.data)
 
@@ -625,45 +886,232 @@ def replayGame( layout, actions, display ):
 
     display.finish()
 
-def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30 ):
+def runGames( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, keepGames=None, resultsFile=None ):
+    """
+    Plays numGames games, the first numTraining of them quietly, and prints a
+    summary of the rest.
+
+    The results of each game are folded into a GameResults as it finishes,
+    and written to resultsFile if given.  Returns the last keepGames of the
+    games that aren't training, or all of them if keepGames is None.
+    """
     import __main__
     __main__.__dict__['_display'] = display
 
     rules = ClassicGameRules(timeout)
-    games = []
-
-    for i in range( numGames ):
-        beQuiet = i < numTraining
-        if beQuiet:
-                # Suppress output and graphics
-            import textDisplay
-            gameDisplay = textDisplay.NullGraphics()
-            rules.quiet = True
+    games = collections.deque(maxlen=keepGames)
+    results = GameResults(resultsFile)
+
+    try:
+        for i in range( numGames ):
+            beQuiet = i < numTraining
+            if beQuiet:
+                    # Suppress output and graphics
+                import textDisplay
+                gameDisplay = textDisplay.NullGraphics()
+                rules.quiet = True
+            else:
+                gameDisplay = display
+                rules.quiet = False
+            game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
+            if record: game.recorder = recordGame( layout, len(game.agents), i )
+            start = time.time()
+            game.run()
+            if record: game.recorder.close( game.state )
+            if not beQuiet:
+                results.addGame(i, game, time.time() - start)
+                games.append(game)
+    finally:
+        results.close()
+
+    if results.count > 0:
+        results.printSummary()
+        printExploration()
+
+    return list(games)
+
+def recordGame( layout, numAgents, i, seed=None ):
+    """
+    Returns a GameLogWriter to record game i as it is played (see gameLog.py).
+    """
+    import time, gameLog
+    fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
+    return gameLog.GameLogWriter( fname, layout, numAgents, seed )
+
+def printSummary( scores, wins ):
+    winRate = wins.count(True)/ float(len(wins))
+    print 'Average Score:', sum(scores) / float(len(scores))
+    print 'Scores:       ', ', '.join([str(score) for score in scores])
+    print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
+    print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
+
+class GameResults:
+    """
+    Running statistics of the games played by runGames or runBatch, folded in
+    as each game finishes so that nothing else about the games has to be kept.
+
+    Only the scores and wins are kept for every game, compactly, for the
+    summary printed at the end.  If a file name is given, each game is also
+    written to it as a row, as CSV if the name ends in .csv and as one JSON
+    object per line otherwise.
+    """
+    FIELDS = ['game', 'score', 'win', 'moves', 'seconds', 'pacmanTime', 'ghostTime']
+
+    def __init__(self, fileName=None):
+        self.scores = array.array('d')
+        self.wins = array.array('b')
+        self.count = 0
+        self.meanScore = 0.0
+        self.scoreSquares = 0.0   # Sum of squared differences from the mean
+        self.totalMoves = 0
+        self.maxMoves = 0
+        self.totalSeconds = 0.0
+        self.maxSeconds = 0.0
+        self.agentTimes = []
+        self.file = None
+        self.writer = None
+        if fileName != None:
+            self.file = open(fileName, 'w')
+            if fileName.endswith('.csv'):
+                import csv
+                self.writer = csv.writer(self.file)
+                self.writer.writerow(self.FIELDS)
+
+    def addGame(self, index, game, seconds):
+        "Adds the result of a finished Game, which took seconds to play."
+        self.add(index, game.state.getScore(), game.state.isWin(), len(game.moveHistory), seconds,
+                 game.totalAgentTimes)
+
+    def add(self, index, score, win, moves, seconds, agentTimes):
+        """
+        Adds the result of game number index.  agentTimes are the seconds each
+        agent spent choosing moves, which are only measured when exceptions
+        are caught.
+        """
+        self.scores.append(score)
+        self.wins.append(win)
+        self.count += 1
+        delta = score - self.meanScore
+        self.meanScore += delta / self.count
+        self.scoreSquares += delta * (score - self.meanScore)
+        self.totalMoves += moves
+        self.maxMoves = max(self.maxMoves, moves)
+        self.totalSeconds += seconds
+        self.maxSeconds = max(self.maxSeconds, seconds)
+        for agentIndex, agentTime in enumerate(agentTimes):
+            if agentIndex == len(self.agentTimes): self.agentTimes.append(0.0)
+            self.agentTimes[agentIndex] += agentTime
+
+        if self.file == None: return
+        row = [index, score, bool(win), moves, seconds, sum(agentTimes[:1]), sum(agentTimes[1:])]
+        if self.writer != None:
+            self.writer.writerow(row)
         else:
-            gameDisplay = display
-            rules.quiet = False
-        game = rules.newGame( layout, pacman, ghosts, gameDisplay, beQuiet, catchExceptions)
+            import json
+            self.file.write(json.dumps(dict(zip(self.FIELDS, row)), sort_keys=True) + '\n')
+
+    def close(self):
+        if self.file != None: self.file.close()
+        self.file = self.writer = None
+
+    def getStatistics(self):
+        "Returns a dictionary of the statistics so far."
+        count = max(self.count, 1)
+        return {'games': self.count,
+                'wins': self.wins.count(True),
+                'meanScore': self.meanScore,
+                'scoreStd': math.sqrt(self.scoreSquares / count),
+                'minScore': min(self.scores or [0]),
+                'maxScore': max(self.scores or [0]),
+                'meanMoves': self.totalMoves / float(count),
+                'maxMoves': self.maxMoves,
+                'meanSeconds': self.totalSeconds / count,
+                'maxSeconds': self.maxSeconds,
+                'meanAgentTimes': [agentTime / count for agentTime in self.agentTimes]}
+
+    def printSummary(self):
+        printSummary(self.scores, self.wins)
+
+def printExploration():
+    metrics = GameState.getExplorationMetrics()
+    if metrics['mode'] == 'off': return
+    line = 'Explored:      %d successors generated' % metrics['successors']
+    if metrics['mode'] == 'set':
+        line += ', %d distinct states' % metrics['distinct']
+        if metrics['capped']: line += ' (capped)'
+    elif metrics['mode'] == 'estimate':
+        line += ', about %d distinct states' % metrics['distinct']
+    print line
+
+def runBatch( layout, pacman, ghosts, display, numGames, record, numTraining = 0, catchExceptions=False, timeout=30, jobs=0, seed=None, resultsFile=None ):
+    """
+    Plays the same games as runGames, but without graphics and spread over a
+    pool of worker processes, one per core unless jobs says otherwise.
+
+    Game i is seeded with (seed, i) and starts from its own copy of the agents,
+    so the results are the same however many processes play them.  Training
+    games are played first, in this process, so that the copies the workers
+    make are of the trained agents.
+
+    Returns the GameResults of the games that aren't training.
+    """
+    import multiprocessing
+
+    if numTraining > 0:
+        runGames( layout, pacman, ghosts, display, numTraining, False, numTraining, catchExceptions, timeout, 0 )
+    results = GameResults( resultsFile )
+    if numGames <= numTraining:
+        results.close()
+        return results
+    if seed == None: seed = random.randrange(sys.maxint)
+
+    start = time.time()
+    pool = multiprocessing.Pool( jobs or None, _initBatchWorker, ((layout, pacman, ghosts, catchExceptions, timeout, record),) )
+    try:
+        games = pool.imap( _playBatchGame, [(seed, i) for i in range( numTraining, numGames )], 1 )
+        for i in range( numTraining, numGames ):
+            # A timeout on next() lets Ctrl-C through to this process in Python 2
+            score, win, moves, seconds, agentTimes = games.next( 1e9 )
+            results.add( i, score, win, moves, seconds, agentTimes )
+    except:
+        pool.terminate()
+        raise
+    finally:
+        results.close()
+    pool.close()
+    pool.join()
+    elapsed = time.time() - start
+
+    results.printSummary()
+    print 'Time:          %.2fs per game (max %.2fs), %.2fs for %d games on %d processes' % (
+        results.totalSeconds / results.count, results.maxSeconds, elapsed, results.count, jobs or multiprocessing.cpu_count())
+    return results
+
+# The game components every worker of a runBatch pool starts from
+_batchSetup = None
+
+def _initBatchWorker( setup ):
+    global _batchSetup
+    _batchSetup = setup
+
+def _playBatchGame( task ):
+    import copy, textDisplay
+    seed, i = task
+    layout, pacman, ghosts, catchExceptions, timeout, record = _batchSetup
+    random.seed( (seed, i) )
+    pacman, ghosts = copy.deepcopy( (pacman, ghosts) )
+    rules = ClassicGameRules( timeout )
+    rules.quiet = True
+    start = time.time()
+    util.mutePrint()
+    try:
+        game = rules.newGame( layout, pacman, ghosts, textDisplay.NullGraphics(), True, catchExceptions )
+        if record: game.recorder = recordGame( layout, len(game.agents), i, (seed, i) )
         game.run()
-        if not beQuiet: games.append(game)
-
-        if record:
-            import time, cPickle
-            fname = ('recorded-game-%d' % (i + 1)) +  '-'.join([str(t) for t in time.localtime()[1:6]])
-            f = file(fname, 'w')
-            components = {'layout': layout, 'actions': game.moveHistory}
-            cPickle.dump(components, f)
-            f.close()
-
-    if (numGames-numTraining) > 0:
-        scores = [game.state.getScore() for game in games]
-        wins = [game.state.isWin() for game in games]
-        winRate = wins.count(True)/ float(len(wins))
-        print 'Average Score:', sum(scores) / float(len(scores))
-        print 'Scores:       ', ', '.join([str(score) for score in scores])
-        print 'Win Rate:      %d/%d (%.2f)' % (wins.count(True), len(wins), winRate)
-        print 'Record:       ', ', '.join([ ['Loss', 'Win'][int(w)] for w in wins])
-
-    return games
+        if record: game.recorder.close( game.state )
+    finally:
+        util.unmutePrint()
+    return game.state.getScore(), game.state.isWin(), len(game.moveHistory), time.time() - start, game.totalAgentTimes
 
 if __name__ == '__main__':
     """
@@ -677,7 +1125,10 @@ if __name__ == '__main__':
     > python pacman.py --help
     """
     args = readCommand( sys.argv[1:] ) # Get game components based on input
-    runGames( **args )
+    if 'jobs' in args:
+        runBatch( **args )
+    else:
+        runGames( **args )
 
     # import cProfile
     # cProfile.run("runGames( **args )")
@@ -68,7 +68,7 @@ class PartialAgent(Agent):
 
         location = api.whereAmI(state)
         # Sets the current location as visited, so that unvisited points are up to date
-        self.map[location].seen = True
+        mark_seen(self.map[location])
 
         # It is never beneficial to stop in this version of the game
         legal = api.legalActions(state)
@@ -154,26 +154,62 @@ def directional_weight(base, point):
 
 # Creates a graph of the traversible points on the map (as an adjacency set within a set)
 def fill_map(state):
-    unvisited = {}
-    corners = api.corners(state)
-    walls = api.walls(state)
+    adjacency = api.adjacency(state)
 
-    # Add all nodes that aren't walls ( Assume all pacman layouts are rectangular and start at (0,0) )
-    dimensions = sorted(corners, key=lambda x: util.manhattanDistance((0, 0), x), reverse=True)[0]
-    for x in range(0, dimensions[0] + 1):
-        for y in range(0, dimensions[1] + 1):
-            if (x, y) not in walls:
-                unvisited[(x, y)] = Node((x, y))
+    # Add all nodes that aren't walls
+    unvisited = dict((position, Node(position)) for position in adjacency)
 
     # Add neighbors to each node
-    keys = unvisited.iterkeys()
-    for key in keys:
-        unvisited[key].connected = [node for node in unvisited.values() if node.distance(unvisited[key]) == 1]
+    for position, neighbors in adjacency.iteritems():
+        unvisited[position].connected = [unvisited[neighbor] for neighbor in neighbors]
 
     # Return map
     return unvisited
 
 
+# Marks a node as seen, and repairs the distance to the nearest unseen point of every node that depended on it.
+# Only nodes that were nearest to this node can get further away, so only they are recalculated:
+# 1. Walking outwards from the node, find the nodes left without a neighbor one step closer to an unseen point
+# 2. Give each of them the best distance through a neighbor that is still correct
+# 3. Relax the distances between them, closest first (Dijkstra with unit weights)
+def mark_seen(node):
+    if node.seen:
+        return
+    node.seen = True
+
+    # 1. Find affected nodes, one distance at a time
+    affected = set([node])
+    frontier = [node]
+    while frontier:
+        next_frontier = []
+        for vertex in frontier:
+            for next in vertex.connected:
+                if next in affected or next.unseen_distance != vertex.unseen_distance + 1:
+                    continue
+                supported = [other for other in next.connected
+                             if other.unseen_distance == next.unseen_distance - 1 and other not in affected]
+                if not supported:
+                    affected.add(next)
+                    next_frontier.append(next)
+        frontier = next_frontier
+
+    # 2. Distances through unaffected neighbors
+    queue = util.LazyPriorityQueue()
+    for vertex in affected:
+        vertex.unseen_distance = min([other.unseen_distance + 1 for other in vertex.connected if other not in affected]
+                                     + [float('inf')])
+        if vertex.unseen_distance != float('inf'):
+            queue.push(vertex, vertex.unseen_distance)
+
+    # 3. Distances through other affected nodes
+    while not queue.isEmpty():
+        vertex = queue.pop()
+        for next in vertex.connected:
+            if next in affected and next.unseen_distance > vertex.unseen_distance + 1:
+                next.unseen_distance = vertex.unseen_distance + 1
+                queue.update(next, next.unseen_distance)
+
+
 # An object to represent each node in the graph generated
 class Node():
     # A list of all neighboring nodes
@@ -182,23 +218,17 @@ class Node():
     def __init__(self, value):
         self.value = value
         self.seen = False
+        # Distance to the nearest unseen point, kept up to date by mark_seen
+        self.unseen_distance = 0
 
     # The minimum distance from one point to another |x_1 - x_2| + |y_1 - y_2|
     def distance(self, other):
         return util.manhattanDistance(self.value, other.value)
 
-    # Simple BFS to find distance to nearest unseen food
+    # Distance to nearest unseen food
     # Returns 0 if this point is unvisited, 1 if one of it's neighbors is unvisited, etc...
     def distance_to_unseen(self):
-        if self.seen == False:
-            return 0
-        queue = [(self, [self])]
-        while queue:
-            (vertex, path) = queue.pop(0)
-            for next in set(vertex.connected) - set(path):
-                if not next.seen:
-                    return len(path)
-                else:
-                    queue.append((next, path + [next]))
-        raise NotImplementedError('No unvisited points remain but game not complete.')
+        if self.unseen_distance == float('inf'):
+            raise NotImplementedError('No unvisited points remain but game not complete.')
+        return self.unseen_distance
 
@@ -0,0 +1,82 @@
+# partialBenchmark.py
+#
+# Measures the per-move cost of partialAgents.PartialAgent.
+#
+# For each layout, plays the same seeded games with no graphics and reports the wall time per move spent in
+# getAction.
+#
+#   python partialBenchmark.py
+#   python partialBenchmark.py -l bigSearch,originalClassic,mediumClassic -n 5
+
+import random
+import sys
+import time
+
+import ghostAgents
+import layout
+import pacman
+import partialAgents
+import textDisplay
+import util
+
+
+# A PartialAgent that keeps the wall time of each getAction call
+class TimedPartialAgent(partialAgents.PartialAgent):
+
+    def __init__(self):
+        partialAgents.PartialAgent.__init__(self)
+        self.moveTimes = []
+
+    def getAction(self, state):
+        start = time.time()
+        action = partialAgents.PartialAgent.getAction(self, state)
+        self.moveTimes.append(time.time() - start)
+        return action
+
+
+# Plays numGames seeded games on the layout, returning the number of wins and the time of every move
+def benchmark(layoutName, numGames, numGhosts, timeout):
+    lay = layout.getLayout(layoutName)
+    rules = pacman.ClassicGameRules(timeout)
+    wins = 0
+    moveTimes = []
+    for i in range(numGames):
+        random.seed('%s-%d' % (layoutName, i))
+        util.mutePrint()
+        try:
+            agent = TimedPartialAgent()
+            ghosts = [ghostAgents.RandomGhost(index + 1) for index in range(numGhosts)]
+            game = rules.newGame(lay, agent, ghosts, textDisplay.NullGraphics(), True)
+            game.run()
+        finally:
+            util.unmutePrint()
+        wins += int(game.state.isWin())
+        moveTimes += agent.moveTimes
+    return wins, moveTimes
+
+
+def readCommand(argv):
+    from optparse import OptionParser
+    parser = OptionParser("python partialBenchmark.py <options>")
+    parser.add_option('-l', '--layouts', dest='layouts', default='bigSearch,originalClassic',
+                      help='Comma separated layouts to benchmark [Default: %default]')
+    parser.add_option('-n', '--numGames', dest='numGames', type='int', default=3,
+                      help='The number of games per layout [Default: %default]')
+    parser.add_option('-k', '--numghosts', dest='numGhosts', type='int', default=4,
+                      help='The maximum number of ghosts to use [Default: %default]')
+    parser.add_option('--timeout', dest='timeout', type='int', default=30,
+                      help='Maximum length of time an agent can spend computing in a single game [Default: %default]')
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+
+if __name__ == '__main__':
+    options = readCommand(sys.argv[1:])
+    print '%-22s %7s %7s %10s %10s' % ('Layout', 'Wins', 'Moves', 'ms/move', 'max ms')
+    for layoutName in options.layouts.split(','):
+        wins, moveTimes = benchmark(layoutName, options.numGames, options.numGhosts, options.timeout)
+        moves = max(len(moveTimes), 1)
+        print '%-22s %3d/%-3d %7d %10.3f %10.3f' % (layoutName, wins, options.numGames, len(moveTimes),
+                                                    1000 * sum(moveTimes) / moves, 1000 * max(moveTimes + [0]))
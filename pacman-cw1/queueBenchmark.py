@@ -0,0 +1,140 @@
+# queueBenchmark.py
+#
+# Measures the queues in util on the frontiers of maze searches.
+#
+# For each layout, runs uniform cost search with update from seeded random starts, with seeded random step costs so
+# that priorities really do get lowered, and breadth first search, and reports the time per search for each queue.
+# The list Queue that util used to have is included for comparison, and every queue has to expand the squares in the
+# same order.
+#
+#   python queueBenchmark.py
+#   python queueBenchmark.py -l bigMaze,openMaze,bigSearch -n 20
+#   python queueBenchmark.py -l openMaze -s 4    # a 4x4 tiling of openMaze, with far bigger frontiers
+
+import random
+import sys
+import time
+
+import layout
+import util
+
+
+# The Queue util used to have, which pushes onto the front of a list
+class ListQueue(util.Queue):
+
+    def __init__(self):
+        self.list = []
+
+    def push(self, item):
+        self.list.insert(0, item)
+
+    def pop(self):
+        return self.list.pop()
+
+
+# Returns the layout with its inside repeated scale times across and up, inside one border
+def tileLayout(lay, scale):
+    inside = [row[1:-1] * scale for row in lay.layoutText[1:-1]] * scale
+    border = '%' * (len(inside[0]) + 2)
+    return layout.Layout([border] + ['%' + row + '%' for row in inside] + [border])
+
+
+# Returns the neighbours of every open square of the layout, and a seeded random cost for stepping onto each
+def mazeGraph(lay, seed):
+    rng = random.Random(seed)
+    walls = lay.walls
+    neighbours = {}
+    for x in range(lay.width):
+        for y in range(lay.height):
+            if walls[x][y]:
+                continue
+            neighbours[(x, y)] = [(x + dx, y + dy) for dx, dy in [(0, 1), (0, -1), (1, 0), (-1, 0)]
+                                  if not walls[x + dx][y + dy]]
+    costs = dict([(square, rng.randint(1, 9)) for square in sorted(neighbours)])
+    return neighbours, costs
+
+
+# Uniform cost search from start over the whole maze, returning the order squares were expanded in
+def uniformCostSearch(neighbours, costs, start, queueClass):
+    queue = queueClass()
+    distances = {start: 0}
+    expanded = set()
+    order = []
+    queue.push(start, 0)
+    while not queue.isEmpty():
+        square = queue.pop()
+        if square in expanded:
+            continue
+        expanded.add(square)
+        order.append(square)
+        for next in neighbours[square]:
+            distance = distances[square] + costs[next]
+            if next not in expanded and distance < distances.get(next, float('inf')):
+                distances[next] = distance
+                queue.update(next, distance)
+    return order
+
+
+# Breadth first search from start over the whole maze, returning the order squares were expanded in
+def breadthFirstSearch(neighbours, start, queueClass):
+    queue = queueClass()
+    seen = set([start])
+    order = []
+    queue.push(start)
+    while not queue.isEmpty():
+        square = queue.pop()
+        order.append(square)
+        for next in neighbours[square]:
+            if next not in seen:
+                seen.add(next)
+                queue.push(next)
+    return order
+
+
+# Times numSearches searches of each kind from random starts, checking every queue expands squares in the same order
+def benchmark(layoutName, numSearches, scale):
+    lay = tileLayout(layout.getLayout(layoutName), scale)
+    neighbours, costs = mazeGraph(lay, layoutName)
+    rng = random.Random(layoutName)
+    starts = [rng.choice(sorted(neighbours)) for i in range(numSearches)]
+    searches = [('ucs', lambda start, queueClass: uniformCostSearch(neighbours, costs, start, queueClass),
+                 [util.PriorityQueue, util.IndexedPriorityQueue, util.LazyPriorityQueue]),
+                ('bfs', lambda start, queueClass: breadthFirstSearch(neighbours, start, queueClass),
+                 [ListQueue, util.Queue])]
+    rows = []
+    for searchName, search, queueClasses in searches:
+        orders = None
+        for queueClass in queueClasses:
+            start = time.time()
+            results = [search(square, queueClass) for square in starts]
+            elapsed = time.time() - start
+            if orders is None:
+                orders = results
+            elif results != orders:
+                raise Exception('%s expanded squares in a different order on %s' % (queueClass.__name__, layoutName))
+            rows.append((searchName, queueClass.__name__, 1000 * elapsed / numSearches))
+    return len(neighbours), rows
+
+
+def readCommand(argv):
+    from optparse import OptionParser
+    parser = OptionParser("python queueBenchmark.py <options>")
+    parser.add_option('-l', '--layouts', dest='layouts', default='bigMaze,openMaze',
+                      help='Comma separated layouts to benchmark [Default: %default]')
+    parser.add_option('-n', '--numSearches', dest='numSearches', type='int', default=10,
+                      help='The number of searches per layout and queue [Default: %default]')
+    parser.add_option('-s', '--scale', dest='scale', type='int', default=1,
+                      help='Tile each layout this many times across and up [Default: %default]')
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+
+if __name__ == '__main__':
+    options = readCommand(sys.argv[1:])
+    print '%-22s %7s %-6s %-20s %10s' % ('Layout', 'Squares', 'Search', 'Queue', 'ms/search')
+    for layoutName in options.layouts.split(','):
+        squares, rows = benchmark(layoutName, options.numSearches, options.scale)
+        for searchName, queueName, milliseconds in rows:
+            print '%-22s %7d %-6s %-20s %10.2f' % (layoutName, squares, searchName, queueName, milliseconds)
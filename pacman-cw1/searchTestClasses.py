@@ -14,6 +14,7 @@
 
 import re
 import testClasses
+import testParser
 import textwrap
 
 # import project specific code
@@ -21,6 +22,19 @@ import layout
 import pacman
 from search import SearchProblem
 
+# layouts built from the text of tests, shared by every test with the same text
+LAYOUT_CACHE = {}
+
+# returns the layout described by the text of a test, built only the first time
+# that text is seen, and loaded from the test cache after that
+def parseLayout(layoutText):
+    if layoutText not in LAYOUT_CACHE:
+        LAYOUT_CACHE[layoutText] = testParser.loadCached('layout', layoutText, makeLayout)
+    return LAYOUT_CACHE[layoutText]
+
+def makeLayout(layoutText):
+    return layout.Layout([l.strip() for l in layoutText.split('\n')])
+
 # helper function for printing solutions in solution files
 def wrap_solution(solution):
     if type(solution) == type([]):
@@ -269,7 +283,7 @@ class PacmanSearchTest(testClasses.TestCase):
 
     def getSolInfo(self, search, searchAgents):
         alg = getattr(search, self.alg)
-        lay = layout.Layout([l.strip() for l in self.layout_text.split('\n')])
+        lay = parseLayout(self.layout_text)
         start_state = pacman.GameState()
         start_state.initialize(lay, 0)
 
@@ -386,7 +400,7 @@ class CornerProblemTest(testClasses.TestCase):
         self.layoutName = testDict['layoutName']
 
     def solution(self, search, searchAgents):
-        lay = layout.Layout([l.strip() for l in self.layoutText.split('\n')])
+        lay = parseLayout(self.layoutText)
         gameState = pacman.GameState()
         gameState.initialize(lay, 0)
         problem = searchAgents.CornersProblem(gameState)
@@ -474,7 +488,7 @@ class HeuristicTest(testClasses.TestCase):
         self.heuristicName = testDict['heuristic']
 
     def setupProblem(self, searchAgents):
-        lay = layout.Layout([l.strip() for l in self.layoutText.split('\n')])
+        lay = parseLayout(self.layoutText)
         gameState = pacman.GameState()
         gameState.initialize(lay, 0)
         problemClass = getattr(searchAgents, self.searchProblemClassName)
@@ -558,7 +572,7 @@ class HeuristicGrade(testClasses.TestCase):
         self.thresholds = [int(t) for t in testDict['gradingThresholds'].split()]
 
     def setupProblem(self, searchAgents):
-        lay = layout.Layout([l.strip() for l in self.layoutText.split('\n')])
+        lay = parseLayout(self.layoutText)
         gameState = pacman.GameState()
         gameState.initialize(lay, 0)
         problemClass = getattr(searchAgents, self.searchProblemClassName)
@@ -632,7 +646,7 @@ class ClosestDotTest(testClasses.TestCase):
         self.layoutName = testDict['layoutName']
 
     def solution(self, searchAgents):
-        lay = layout.Layout([l.strip() for l in self.layoutText.split('\n')])
+        lay = parseLayout(self.layoutText)
         gameState = pacman.GameState()
         gameState.initialize(lay, 0)
         path = searchAgents.ClosestDotSearchAgent().findPathToClosestDot(gameState)
@@ -692,7 +706,7 @@ class CornerHeuristicSanity(testClasses.TestCase):
         search = moduleDict['search']
         searchAgents = moduleDict['searchAgents']
         game_state = pacman.GameState()
-        lay = layout.Layout([l.strip() for l in self.layout_text.split('\n')])
+        lay = parseLayout(self.layout_text)
         game_state.initialize(lay, 0)
         problem = searchAgents.CornersProblem(game_state)
         start_state = problem.getStartState()
@@ -747,7 +761,7 @@ class CornerHeuristicSanity(testClasses.TestCase):
         handle.write('# true cost of the optimal path from that state to a goal.\n')
 
         # solve problem and write solution
-        lay = layout.Layout([l.strip() for l in self.layout_text.split('\n')])
+        lay = parseLayout(self.layout_text)
         start_state = pacman.GameState()
         start_state.initialize(lay, 0)
         problem = searchAgents.CornersProblem(start_state)
@@ -772,7 +786,7 @@ class CornerHeuristicPacman(testClasses.TestCase):
         true_cost = float(solutionDict['cost'])
         thresholds = map(int, solutionDict['thresholds'].split())
         game_state = pacman.GameState()
-        lay = layout.Layout([l.strip() for l in self.layout_text.split('\n')])
+        lay = parseLayout(self.layout_text)
         game_state.initialize(lay, 0)
         problem = searchAgents.CornersProblem(game_state)
         start_state = problem.getStartState()
@@ -808,7 +822,7 @@ class CornerHeuristicPacman(testClasses.TestCase):
         handle.write('# used in scoring.\n')
 
         # solve problem and write solution
-        lay = layout.Layout([l.strip() for l in self.layout_text.split('\n')])
+        lay = parseLayout(self.layout_text)
         start_state = pacman.GameState()
         start_state.initialize(lay, 0)
         problem = searchAgents.CornersProblem(start_state)
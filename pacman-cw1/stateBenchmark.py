@@ -0,0 +1,100 @@
+# stateBenchmark.py
+#
+# Measures how much memory each game state takes and how fast successors are generated.
+#
+# For each layout, plays seeded random moves for every agent in turn, starting again from the initial state whenever
+# the game ends, and keeps every state made.  A state's size is the size of the objects reachable from it that it
+# does not share with the layout, summed over all the states and divided by their number, so that the parts states
+# share with their predecessors are counted once.  The rate is the best of a few timed runs of the same moves.
+# Run it on an older checkout to compare before and after a change.
+#
+#   python stateBenchmark.py
+#   python stateBenchmark.py -l mediumClassic,bigSearch -n 5000
+
+import gc
+import os
+import random
+import sys
+import time
+import types
+
+import layout
+import pacman
+
+
+# Plays numMoves seeded random moves on the layout, returning every state made along the way
+def randomStates(lay, numGhosts, numMoves, seed):
+    rng = random.Random(seed)
+    initial = pacman.GameState()
+    initial.initialize(lay, numGhosts)
+    state = initial
+    states = [state]
+    moves = 0
+    while moves < numMoves:
+        if state.isWin() or state.isLose():
+            state = initial
+        agentIndex = moves % state.getNumAgents()
+        state = state.generateSuccessor(agentIndex, rng.choice(state.getLegalActions(agentIndex)))
+        states.append(state)
+        moves += 1
+    return states
+
+
+# Total size in bytes of the objects reachable from roots, counting each once and leaving out those in skip
+def reachableSize(roots, skip):
+    seen = set()
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or id(obj) in skip:
+            continue
+        if isinstance(obj, (type, types.ClassType, types.ModuleType, types.FunctionType)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+
+# Returns the mean bytes per state and the successors generated per second on the layout
+def benchmark(layoutName, numMoves, numRuns):
+    lay = layout.getLayout(layoutName)
+    numGhosts = lay.getNumGhosts()
+    rate = 0
+    for run in range(numRuns):
+        start = time.time()
+        states = randomStates(lay, numGhosts, numMoves, layoutName)
+        rate = max(rate, numMoves / (time.time() - start))
+    skip = set([id(lay)] + [id(obj) for obj in gc.get_referents(lay)])
+    return reachableSize(states, skip) / float(len(states)), rate
+
+
+def readCommand(argv):
+    from optparse import OptionParser
+    parser = OptionParser("python stateBenchmark.py <options>")
+    parser.add_option('-l', '--layouts', dest='layouts', default=None,
+                      help='Comma separated layouts to benchmark [Default: every bundled layout]')
+    parser.add_option('-n', '--numMoves', dest='numMoves', type='int', default=2000,
+                      help='The number of random moves per layout [Default: %default]')
+    parser.add_option('-r', '--runs', dest='runs', type='int', default=3,
+                      help='The number of timed runs per layout [Default: %default]')
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    return options
+
+
+if __name__ == '__main__':
+    options = readCommand(sys.argv[1:])
+    if options.layouts:
+        layoutNames = options.layouts.split(',')
+    else:
+        layoutNames = sorted(name[:-4] for name in os.listdir('layouts') if name.endswith('.lay'))
+    print '%-22s %12s %14s' % ('Layout', 'bytes/state', 'successors/s')
+    rows = []
+    for layoutName in layoutNames:
+        bytesPerState, rate = benchmark(layoutName, options.numMoves, options.runs)
+        rows.append((bytesPerState, rate))
+        print '%-22s %12.0f %14.0f' % (layoutName, bytesPerState, rate)
+    print '%-22s %12.0f %14.0f' % ('mean', sum(row[0] for row in rows) / len(rows), sum(row[1] for row in rows) / len(rows))
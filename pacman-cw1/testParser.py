@@ -12,9 +12,46 @@
 # Pieter Abbeel (pabbeel@cs.berkeley.edu).
 
 
+import cPickle
+import hashlib
+import os
 import re
 import sys
 
+# parsed test files, and anything else built from the text of a test, are
+# kept here under the hash of the text they were built from
+TEST_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.testcache')
+# change this whenever the parser or the objects it caches change, so that
+# nothing built by an older version is loaded
+TEST_CACHE_VERSION = 1
+
+def loadCached(kind, text, build):
+    """
+    Returns build(text), loaded from the cache if the same kind of thing has
+    been built from the same text before, and saved there if not.  Editing
+    the text changes its hash, so stale entries are simply never found.
+    """
+    key = hashlib.sha1('%s %d\n%s' % (kind, TEST_CACHE_VERSION, text)).hexdigest()
+    cacheFile = os.path.join(TEST_CACHE_DIR, '%s.%s' % (key, kind))
+    try:
+        f = open(cacheFile, 'rb')
+        try: return cPickle.load(f)
+        finally: f.close()
+    except Exception:
+        # a missing or unreadable entry is just built again
+        pass
+    value = build(text)
+    try:
+        if not os.path.isdir(TEST_CACHE_DIR): os.makedirs(TEST_CACHE_DIR)
+        tmpName = '%s.%d.tmp' % (cacheFile, os.getpid())
+        f = open(tmpName, 'wb')
+        try: cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+        finally: f.close()
+        os.rename(tmpName, cacheFile)
+    except (IOError, OSError, cPickle.PicklingError):
+        pass
+    return value
+
 class TestParser(object):
 
     def __init__(self, path):
@@ -33,14 +70,22 @@ class TestParser(object):
         return '\n'.join(fixed_lines)
 
     def parse(self):
-        # read in the test case and remove comments
-        test = {}
+        # read in the test case, and parse it unless the same text has been parsed before
         with open(self.path) as handle:
-            raw_lines = handle.read().split('\n')
+            text = handle.read()
+        test = loadCached('test', text, self.parseText)
+        # a path property in the file itself takes precedence
+        if 'path' not in test:
+            test['path'] = self.path
+        return test
+
+    def parseText(self, text):
+        # remove comments
+        test = {}
+        raw_lines = text.split('\n')
 
         test_text = self.removeComments(raw_lines)
         test['__raw_lines__'] = raw_lines
-        test['path'] = self.path
         test['__emit__'] = []
         lines = test_text.split('\n')
         i = 0
@@ -28,7 +28,7 @@
 
 import sys
 import inspect
-import heapq, random
+import heapq, random, collections
 import cStringIO
 
 
@@ -151,18 +151,18 @@ class Stack:
 class Queue:
     "A container with a first-in-first-out (FIFO) queuing policy."
     def __init__(self):
-        self.list = []
+        self.list = collections.deque()
 
     def push(self,item):
         "Enqueue the 'item' into the queue"
-        self.list.insert(0,item)
+        self.list.append(item)
 
     def pop(self):
         """
           Dequeue the earliest enqueued item still in the queue. This
           operation removes the item from the queue.
         """
-        return self.list.pop()
+        return self.list.popleft()
 
     def isEmpty(self):
         "Returns true if the queue is empty"
@@ -174,6 +174,9 @@ class PriorityQueue:
       has a priority associated with it and the client is usually interested
       in quick retrieval of the lowest-priority item in the queue. This
       data structure allows O(1) access to the lowest-priority item.
+
+      update scans the heap for the item; IndexedPriorityQueue and
+      LazyPriorityQueue find it in O(1) instead.
     """
     def  __init__(self):
         self.heap = []
@@ -206,6 +209,174 @@ class PriorityQueue:
         else:
             self.push(item, priority)
 
+class IndexedPriorityQueue:
+    """
+      A priority queue with the same interface as PriorityQueue, for callers
+      that update a lot: update lowers a priority in O(log n) instead of
+      scanning the heap, at the cost of slower pushes and pops.
+
+      Items with equal priorities come out in the order they were pushed.
+      If an item is in the queue more than once, update changes the copy with
+      the lowest priority, where PriorityQueue changes whichever copy it comes
+      to first, so the two can pop such items in different orders.
+
+      Each heap entry is [priority, count, item, index], where index is the
+      entry's place in the heap, and entries maps each item to its entries.
+      Items that can't be hashed are still found by scanning.
+    """
+    def  __init__(self):
+        self.heap = []
+        self.count = 0
+        self.entries = {}
+
+    def push(self, item, priority):
+        entry = [priority, self.count, item, len(self.heap)]
+        self.heap.append(entry)
+        self.count += 1
+        self._siftUp(entry[3])
+        try:
+            self.entries.setdefault(item, []).append(entry)
+        except TypeError:
+            pass
+
+    def pop(self):
+        heap = self.heap
+        entry = heap[0]
+        last = heap.pop()
+        if heap:
+            last[3] = 0
+            heap[0] = last
+            self._siftDown(0)
+        self._forget(entry)
+        return entry[2]
+
+    def isEmpty(self):
+        return len(self.heap) == 0
+
+    def update(self, item, priority):
+        # If item already in priority queue with higher priority, update its priority and rebuild the heap.
+        # If item already in priority queue with equal or lower priority, do nothing.
+        # If item not in priority queue, do the same thing as self.push.
+        # (If it is in more than once, the copy with the lowest priority is the one that counts.)
+        try:
+            entries = self.entries.get(item)
+        except TypeError:
+            entries = [entry for entry in self.heap if entry[2] == item]
+        if not entries:
+            self.push(item, priority)
+            return
+        entry = min(entries)
+        if entry[0] <= priority: return
+        entry[0] = priority
+        self._siftUp(entry[3])
+
+    def _forget(self, entry):
+        try:
+            entries = self.entries.get(entry[2])
+        except TypeError:
+            return
+        if len(entries) == 1:
+            del self.entries[entry[2]]
+        else:
+            entries.remove(entry)
+
+    def _siftUp(self, index):
+        heap = self.heap
+        entry = heap[index]
+        while index > 0:
+            parentIndex = (index - 1) >> 1
+            parent = heap[parentIndex]
+            if not entry < parent: break
+            parent[3] = index
+            heap[index] = parent
+            index = parentIndex
+        entry[3] = index
+        heap[index] = entry
+
+    def _siftDown(self, index):
+        heap = self.heap
+        size = len(heap)
+        entry = heap[index]
+        while True:
+            childIndex = 2 * index + 1
+            if childIndex >= size: break
+            child = heap[childIndex]
+            if childIndex + 1 < size and heap[childIndex + 1] < child:
+                childIndex += 1
+                child = heap[childIndex]
+            if not child < entry: break
+            child[3] = index
+            heap[index] = child
+            index = childIndex
+        entry[3] = index
+        heap[index] = entry
+
+class LazyPriorityQueue:
+    """
+      A priority queue with the same behaviour as IndexedPriorityQueue, built on
+      heapq with lazy deletion: update pushes a new entry for the item, keeping
+      its place among equal priorities, and marks the old one removed, to be
+      skipped when it reaches the top.  Pushes and pops run at heapq's speed
+      in exchange for the removed entries staying in the heap until then.
+    """
+    REMOVED = object()
+
+    def  __init__(self):
+        self.heap = []
+        self.count = 0
+        self.size = 0
+        self.entries = {}
+
+    def push(self, item, priority):
+        self._add([priority, self.count, item])
+        self.count += 1
+
+    def _add(self, entry):
+        heapq.heappush(self.heap, entry)
+        self.size += 1
+        try:
+            self.entries.setdefault(entry[2], []).append(entry)
+        except TypeError:
+            pass
+
+    def pop(self):
+        while True:
+            entry = heapq.heappop(self.heap)
+            if entry[2] is not LazyPriorityQueue.REMOVED: break
+        self.size -= 1
+        self._forget(entry)
+        return entry[2]
+
+    def isEmpty(self):
+        return self.size == 0
+
+    def update(self, item, priority):
+        # The same as IndexedPriorityQueue.update
+        try:
+            entries = self.entries.get(item)
+        except TypeError:
+            entries = [entry for entry in self.heap if entry[2] == item]
+        if not entries:
+            self.push(item, priority)
+            return
+        entry = min(entries)
+        if entry[0] <= priority: return
+        self._forget(entry)
+        self.size -= 1
+        entry[2] = LazyPriorityQueue.REMOVED
+        self._add([priority, entry[1], item])
+
+    def _forget(self, entry):
+        try:
+            entries = self.entries.get(entry[2])
+        except TypeError:
+            return
+        if entries == None: return
+        if len(entries) == 1:
+            del self.entries[entry[2]]
+        else:
+            entries.remove(entry)
+
 class PriorityQueueWithFunction(PriorityQueue):
     """
     Implements a priority queue with the same push/pop signature of the
@@ -223,6 +394,128 @@ class PriorityQueueWithFunction(PriorityQueue):
         PriorityQueue.push(self, item, self.priorityFunction(item))
 
 
+class TranspositionTable:
+    """
+    A bounded memo of values found for game states, for search agents that
+    reach the same state along different lines of play.
+
+    Entries go in a fixed number of slots picked by the hash of the state
+    (its Zobrist key, for GameStates), and are told apart by the full hash, so
+    two states whose hashes are the same share an entry.  When a new entry
+    lands on a slot that is in use, replace='depth' keeps whichever was
+    searched deeper, preferring the new one on a tie, and replace='always'
+    keeps the new one.  hits, misses and replacements count what happened.
+    """
+    def __init__(self, size=65536, replace='depth'):
+        if replace not in ['depth', 'always']: raise Exception('Unknown replacement policy ' + str(replace))
+        self.size = size
+        self.replace = replace
+        self.slots = [None] * size
+        self.hits = 0
+        self.misses = 0
+        self.replacements = 0
+
+    def lookup(self, state, depth=0):
+        "Returns the value stored for state, if it was searched to at least depth, or None"
+        key = hash(state)
+        entry = self.slots[key % self.size]
+        if entry != None and entry[0] == key and entry[1] >= depth:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        return None
+
+    def store(self, state, value, depth=0):
+        "Stores the value found for state by a search to the given depth"
+        key = hash(state)
+        slot = key % self.size
+        entry = self.slots[slot]
+        if entry != None:
+            if self.replace == 'depth' and entry[1] > depth: return
+            if entry[0] != key: self.replacements += 1
+        self.slots[slot] = (key, depth, value)
+
+    def clear(self):
+        self.slots = [None] * self.size
+        self.hits = 0
+        self.misses = 0
+        self.replacements = 0
+
+    def __len__(self):
+        return self.size - self.slots.count(None)
+
+class ExplorationCounter:
+    """
+    Keeps track of the states that successors are generated from and to, for
+    measuring how much of the state space a search explores.  The mode says
+    how much is kept:
+
+      'off'       nothing at all
+      'count'     just the number of successors generated
+      'set'       the distinct states themselves, the exact set, but no more
+                  than cap of them if a cap is given
+      'estimate'  a HyperLogLog estimate of the number of distinct states, in
+                  2**precision small counters whatever the number of states
+    """
+    MODES = ['off', 'count', 'set', 'estimate']
+
+    def __init__(self, mode='off', cap=None, precision=12):
+        if mode not in ExplorationCounter.MODES: raise Exception('Unknown exploration mode ' + str(mode))
+        self.mode = mode
+        self.cap = cap
+        self.precision = precision
+        self.reset()
+
+    def reset(self):
+        self.successors = 0
+        self.states = set()
+        self.capped = False
+        self.registers = [0] * (1 << self.precision)
+
+    def explore(self, parent, child):
+        "Records that child was generated as a successor of parent"
+        if self.mode == 'off': return
+        self.successors += 1
+        if self.mode == 'set':
+            for state in (parent, child):
+                if self.cap == None or len(self.states) < self.cap:
+                    self.states.add(state)
+                elif state not in self.states:
+                    self.capped = True
+        elif self.mode == 'estimate':
+            self._addToEstimate(hash(parent))
+            self._addToEstimate(hash(child))
+
+    def _addToEstimate(self, h):
+        # Spread the hash over all 64 bits (the splitmix64 finalizer), then use
+        # the top bits to pick a register and the position of the first one
+        # bit in the rest as the observation.
+        h &= 0xFFFFFFFFFFFFFFFF
+        h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        h ^= h >> 31
+        bits = 64 - self.precision
+        register = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[register]: self.registers[register] = rank
+
+    def getDistinct(self):
+        "Returns the number of distinct states seen (estimated in 'estimate' mode), or None if not kept"
+        if self.mode == 'set': return len(self.states)
+        if self.mode != 'estimate': return None
+        import math
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum([2.0 ** -r for r in self.registers])
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * m and empty > 0:
+            # Few states: counting empty registers is more accurate
+            estimate = m * math.log(float(m) / empty)
+        return int(round(estimate))
+
+    def getMetrics(self):
+        "Returns a dictionary of what has been recorded"
+        return {'mode': self.mode, 'successors': self.successors, 'distinct': self.getDistinct(), 'capped': self.capped}
+
 def manhattanDistance( xy1, xy2 ):
     "Returns the Manhattan distance between points xy1 and xy2"
     return abs( xy1[0] - xy2[0] ) + abs( xy1[1] - xy2[1] )
@@ -601,48 +894,147 @@ def pause():
 
 # code to handle timeouts
 #
-# FIXME
-# NOTE: TimeoutFuncton is NOT reentrant.  Later timeouts will silently
-# disable earlier timeouts.  Could be solved by maintaining a global list
-# of active time outs.  Currently, questions which have test cases calling
-# this have all student code so wrapped.
+# Timed calls share a global stack of deadlines, innermost last, so they nest
+# safely: a call can never outlive the calls it was made inside.  Where there
+# is SIGALRM a single interval timer is kept armed for the innermost deadline,
+# and its handler raises TimeoutFunctionException once that has passed.
 #
 import signal
 import time
+
+def _monotonicClock():
+    """
+    Returns a function giving the time in seconds on a clock that never goes
+    backwards, falling back to time.time where there isn't one.
+    """
+    if hasattr(time, 'monotonic'): return time.monotonic
+    clockIds = {'linux': 1, 'darwin': 6}
+    clockId = clockIds.get(sys.platform.rstrip('0123456789'))
+    if clockId == None: return time.time
+    try:
+        import ctypes, ctypes.util
+        class Timespec(ctypes.Structure):
+            _fields_ = [('seconds', ctypes.c_long), ('nanoseconds', ctypes.c_long)]
+        library = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'))
+        # Left without argtypes, which would double the cost of each call
+        clockGettime = library.clock_gettime
+        timespec = Timespec()
+        pointer = ctypes.pointer(timespec)
+        def monotonic():
+            clockGettime(clockId, pointer)
+            return timespec.seconds + timespec.nanoseconds * 1e-9
+        monotonic()
+        return monotonic
+    except (OSError, AttributeError):
+        return time.time
+
+monotonicTime = _monotonicClock()
+
+_DEADLINES = []
+_HAS_WATCHDOG = hasattr(signal, 'setitimer')
+
+def _armWatchdog(now):
+    "Points the interval timer at the innermost deadline, or stops it if there is none."
+    if not _HAS_WATCHDOG: return
+    if _DEADLINES:
+        # setitimer treats 0 as 'stop', so a deadline that has passed fires at once
+        signal.setitimer(signal.ITIMER_REAL, max(_DEADLINES[-1] - now, 1e-6))
+    else:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def getRemainingTime():
+    """
+    Returns the seconds left before the innermost timed call running now must
+    return, or None if nothing is being timed.  Anytime agents can use it to
+    decide when to stop searching.
+    """
+    if not _DEADLINES: return None
+    return max(_DEADLINES[-1] - monotonicTime(), 0.0)
+
 class TimeoutFunctionException(Exception):
     """Exception to raise on a timeout"""
     pass
 
 
-class TimeoutFunction:
-    def __init__(self, function, timeout):
-        self.timeout = timeout
-        self.function = function
+class TimeBudget:
+    """
+    A deadline service for timed calls, with millisecond resolution.
 
-    def handle_timeout(self, signum, frame):
+    A game starts one budget, which installs the SIGALRM handler once, makes
+    each of its timed calls through call, and stops it at the end.  Budgets
+    started inside one another (and TimeoutFunctions) share the deadline
+    stack, so the innermost deadline is always the one enforced.
+    """
+    def __init__(self):
+        self.oldHandler = None
+        self.started = False
+
+    def start(self):
+        if self.started: return
+        if _HAS_WATCHDOG:
+            self.oldHandler = signal.signal(signal.SIGALRM, self.handleTimeout)
+        self.started = True
+
+    def stop(self):
+        if not self.started: return
+        if _HAS_WATCHDOG:
+            signal.signal(signal.SIGALRM, self.oldHandler)
+        self.started = False
+
+    def handleTimeout(self, signum, frame):
+        # The timer can go off just as a call returns, or a little early
+        if not _DEADLINES: return
+        now = monotonicTime()
+        if now < _DEADLINES[-1]:
+            _armWatchdog(now)
+            return
         raise TimeoutFunctionException()
 
-    def __call__(self, *args, **keyArgs):
-        # If we have SIGALRM signal, use it to cause an exception if and
-        # when this function runs too long.  Otherwise check the time taken
-        # after the method has returned, and throw an exception then.
-        if hasattr(signal, 'SIGALRM'):
-            old = signal.signal(signal.SIGALRM, self.handle_timeout)
-            signal.alarm(self.timeout)
+    def call(self, timeout, function, *args, **keyArgs):
+        """
+        Calls function, raising TimeoutFunctionException if it has not returned
+        within timeout seconds or before any outer deadline.  Without SIGALRM
+        the function can only be caught out once it has returned.
+        """
+        now = monotonicTime()
+        deadline = now + timeout
+        if _DEADLINES: deadline = min(deadline, _DEADLINES[-1])
+        # The watchdog can go off anywhere, even in a finally block, so the
+        # stack is trimmed back to its depth, again in an outer finally if the
+        # watchdog cuts the first one short.  It can only go off once before
+        # it is armed again.
+        depth = len(_DEADLINES)
+        try:
             try:
-                result = self.function(*args, **keyArgs)
+                _DEADLINES.append(deadline)
+                _armWatchdog(now)
+                result = function(*args, **keyArgs)
             finally:
-                signal.signal(signal.SIGALRM, old)
-            signal.alarm(0)
-        else:
-            startTime = time.time()
-            result = self.function(*args, **keyArgs)
-            timeElapsed = time.time() - startTime
-            if timeElapsed >= self.timeout:
-                self.handle_timeout(None, None)
+                del _DEADLINES[depth:]
+        finally:
+            del _DEADLINES[depth:]
+            now = monotonicTime()
+            _armWatchdog(now)
+        # Also catches functions that swallowed the exception the watchdog raised
+        if now >= deadline:
+            raise TimeoutFunctionException()
         return result
 
 
+class TimeoutFunction:
+    def __init__(self, function, timeout):
+        self.timeout = timeout
+        self.function = function
+
+    def __call__(self, *args, **keyArgs):
+        budget = TimeBudget()
+        budget.start()
+        try:
+            return budget.call(self.timeout, self.function, *args, **keyArgs)
+        finally:
+            budget.stop()
+
+
 
 _ORIGINAL_STDOUT = None
 _ORIGINAL_STDERR = None
@@ -34,6 +34,12 @@ import util
 from game import Agent
 from pacman import Directions
 
+try:
+    import numpy
+    _NUMPY_ENABLED = True
+except ImportError:
+    _NUMPY_ENABLED = False
+
 # When True will print utilities of each move and display map after initialisation
 DEBUG = False
 
@@ -55,15 +61,48 @@ class MDPValues:
     Gamma = 0.65 # This gamma was found to balance long and short term goals
     Threshold = 0.1 # This is not a percentage, it is a raw difference to compare with delta U_i
     DirectionNoise = 0.8 # A percentage - fixed by the api.py - DO NOT CHANGE
+    EvaluationSweeps = 5 # Sweeps of policy evaluation between improvements in modified policy iteration
+
+
+# Solvers for the utilities, selected with -a solver=...
+# The policy solvers are slower than Value Iteration here: evaluating each policy to the same Threshold means 'policy'
+# does about three times the Bellman backups per move of 'value', and 'modified' about twice (see mdpBenchmark.py).
+class Solvers:
+    ValueIteration = 'value' # Bellman backups until no utility changes by more than the Threshold (see Backends)
+    PolicyIteration = 'policy' # Evaluate the policy until it converges, improve it, repeat until it is stable
+    ModifiedPolicyIteration = 'modified' # A few sweeps of policy evaluation between each Bellman backup
+
+
+# Value Iteration backends, selected with -a backend=...
+# 'numpy' backs every state up from the previous sweep's utilities (Jacobi), so it stops at different utilities to the
+# in-place sweep of 'dict' and 'compiled', within the Threshold of them, and its policies are not move-identical to
+# theirs: it makes the same moves as 'compiled' with schedule=jacobi instead. It ignores the schedule.
+class Backends:
+    Dict = 'dict' # The original loop over the dictionary of Nodes
+    Compiled = 'compiled' # The same in-place sweep over a dense state index - gives identical utilities to 'dict'
+    NumPy = 'numpy' # Jacobi sweeps as matrix-vector products over a transition tensor - needs numpy installed
+    Incremental = 'incremental' # Warm-started prioritised sweeping from the squares whose reward changed this move
+
+
+# Sweep orderings for the compiled backend (and the first full sweep of the incremental one), selected with
+# -a schedule=...
+class Schedules:
+    GaussSeidel = 'gauss-seidel' # In place, in map order - the same order as the dict based loop
+    Jacobi = 'jacobi' # Every state is backed up from the previous sweep's utilities
+    Distance = 'distance' # In place, squares closest to Pacman (by maze distance) first
+    RedBlack = 'red-black' # In place, all squares with even x + y first, then all squares with odd x + y
 
 
 # MDP Agent which calculates optimal utility using Bellman's Formula for Value Iteration
 class MDPAgent(Agent):
 
-    def __init__(self):
+    def __init__(self, backend=Backends.Compiled, schedule=Schedules.GaussSeidel, solver=Solvers.ValueIteration):
         print "Starting up MDPAgent!"
         name = "Uncoordinated Pacman"
-        self.map = Map()
+        if backend == Backends.NumPy and not _NUMPY_ENABLED:
+            print "NumPy is not installed, falling back to the compiled backend"
+            backend = Backends.Compiled
+        self.map = Map(backend, schedule, solver)
 
     # Initialise Map
     def registerInitialState(self, state):
@@ -71,9 +110,11 @@ class MDPAgent(Agent):
         corners = api.corners(state)
         # The furthest corner from (0, 0) gives the width and height of the map (given it starts at (0, 0))
         (width, height) = sorted(corners, key=lambda x: util.manhattanDistance((0, 0), x), reverse=True)[0]
-        self.map.initialise(height, width, api.walls(state))
+        self.map.initialise(height, width, api.adjacency(state))
         # Set base values for rewards (set food but not ghosts)
         self.map.initialiseRewards(api.food(state))
+        # The transition model only depends on the walls, so it is built once per game
+        self.map.compileTransitions()
         # Print map when debugging
         if DEBUG:
             self.map.display()
@@ -81,6 +122,12 @@ class MDPAgent(Agent):
     # This is what gets run in between multiple games
     def final(self, state):
         print "Game Over."
+        backups = self.map.getBackups()
+        if backups:
+            print "Bellman backups per move: %.1f (max %d)" % (sum(backups) / float(len(backups)), max(backups))
+        sweeps = [len(trace) for trace in self.map.getTraces()]
+        if sweeps:
+            print "Sweeps per move: %.2f (max %d)" % (sum(sweeps) / float(len(sweeps)), max(sweeps))
 
     # Update the rewards (positive aspects of reward function) and Punishments (negative aspects of reward function)
     # Then run Value Iteration (updateUtilities) to calculate the optimalMove.
@@ -89,7 +136,7 @@ class MDPAgent(Agent):
         self.map.updatePunishments(ghosts)
         location = api.whereAmI(state)
         self.map.updateRewards(location)
-        self.map.updateUtilities()
+        self.map.updateUtilities(location)
         legal = api.legalActions(state)
 
         if CAN_STOP:
@@ -195,24 +242,40 @@ class Node():
 # are stored in the map, walls are not.
 class Map():
 
-    def __init__(self):
+    def __init__(self, backend=Backends.Compiled, schedule=Schedules.GaussSeidel, solver=Solvers.ValueIteration):
         self._map = dict()
         self._height = 0
         self._width = 0
-
-    # Sets the base state of the map
-    def initialise(self, height, width, walls):
+        self._backend = backend
+        self._schedule = schedule
+        self._solver = solver
+        self._model = None # The TransitionModel used by the compiled backends (see compileTransitions)
+        self._changed = set() # Positions whose reward or punishment was set since the last updateUtilities
+        self._backups = [] # The number of Bellman backups done by each updateUtilities call this game
+        self._traces = [] # The max residual of each sweep, for each updateUtilities call this game
+
+    # Sets the base state of the map from the adjacency of the squares that are not walls (see api.adjacency)
+    def initialise(self, height, width, adjacency):
         self._height = height
         self._width = width
+        self._changed = set()
+        self._backups = []
+        self._traces = []
         for x in range(0, width + 1):
             for y in range(0, height + 1):
-                if (x, y) not in walls:
+                if (x, y) in adjacency:
                     self._map[(x, y)] = Node((x, y))
-        keys = self._map.iterkeys()
-        for key in keys:
-            # TODO: This can be optimised by only considering the 4 possible neighbors, rather than all map.values()
-            self._map[key].connected = [node for node in self._map.values() if
-                                        node.minimumDistance(self._map[key]) == 1]
+        for position, neighbors in adjacency.iteritems():
+            self._map[position].connected = [self._map[neighbor] for neighbor in neighbors]
+
+    # Builds the dense TransitionModel used by the compiled backends and policy solvers - needs to be run after
+    # initialise. The states are indexed in the same order as self._map.keys(), so that the compiled sweep visits the
+    # nodes in the same order as the dict based loop.
+    def compileTransitions(self):
+        if self._backend == Backends.Dict and self._solver == Solvers.ValueIteration:
+            self._model = None
+        else:
+            self._model = TransitionModel([self._map[position] for position in self._map.keys()])
 
     # Displays the map (not very beautifully)
     def display(self):
@@ -238,6 +301,35 @@ class Map():
     # Sets the reward of a given node
     def setReward(self, position, value):
         self._map[(position[0], position[1])].setReward(value)
+        self._changed.add((position[0], position[1]))
+
+    # The largest difference between the utilities and the utilities Value Iteration converges to, found by sweeping
+    # again from the current utilities until no utility changes by more than tolerance. The solvers stop within
+    # Threshold / (1 - Gamma) of it. Used by mdpBenchmark --check.
+    def fixedPointError(self, tolerance=1e-9):
+        model = self._model
+        if model is None:
+            model = TransitionModel([self._map[position] for position in self._map.keys()])
+        rewards = [node.rewardFunction() for node in model.nodes]
+        utilities = [node.utility for node in model.nodes]
+        fixedPoint = list(utilities)
+        residual = tolerance + 1
+        while residual > tolerance:
+            residual = 0
+            for i in model.sweepOrder(Schedules.GaussSeidel):
+                utility = model.backup(i, rewards, fixedPoint)
+                residual = max(residual, abs(utility - fixedPoint[i]))
+                fixedPoint[i] = utility
+        return max([abs(utility - fixed) for utility, fixed in zip(utilities, fixedPoint)])
+
+    # The number of Bellman backups done by each updateUtilities call this game
+    def getBackups(self):
+        return self._backups
+
+    # The max residual |U_i+1(s) - U_i(s)| of each sweep, for each updateUtilities call this game.
+    # The length of each trace is the number of sweeps it took to converge.
+    def getTraces(self):
+        return self._traces
 
     # Return width and height
     def getHeight(self):
@@ -248,12 +340,48 @@ class Map():
         return self._width + 1
 
     # Where the magic happens.
+    # Runs the selected solver - Value Iteration with the selected backend unless a policy solver was chosen -
+    # falling back to the dict based loop when the transitions have not been compiled.
+    # Pacman's position is only needed by the distance sweep schedule.
+    def updateUtilities(self, position=None):
+        if self._model is None:
+            trace = self.dictValueIteration()
+            self._backups.append(len(trace) * len(self._map))
+            self._traces.append(trace)
+            self._changed = set()
+            return
+        nodes = self._model.nodes
+        rewards = [node.rewardFunction() for node in nodes]
+        # Last rounds utilities are used as the starting point, exactly as in the dict based loop
+        utilities = [node.utility for node in nodes]
+        order = self._model.sweepOrder(self._schedule, position)
+        jacobi = self._schedule == Schedules.Jacobi
+        if self._solver == Solvers.PolicyIteration:
+            utilities = self._model.policyIteration(rewards, utilities, order)
+        elif self._solver == Solvers.ModifiedPolicyIteration:
+            utilities = self._model.modifiedPolicyIteration(rewards, utilities, order)
+        elif self._backend == Backends.NumPy:
+            utilities = self._model.batchedValueIteration(rewards, utilities)
+        elif self._backend == Backends.Incremental:
+            changed = [self._model.index[changedPosition] for changedPosition in self._changed]
+            utilities = self._model.prioritisedSweep(rewards, utilities, changed, order, jacobi)
+        else:
+            utilities = self._model.valueIteration(rewards, utilities, order, jacobi)
+        for node, utility in zip(nodes, utilities):
+            node.utility = utility
+        self._backups.append(self._model.backups)
+        self._traces.append(self._model.trace)
+        self._changed = set()
+
     # This is a Value Iteration using the Bellman Equation.
     # The ValueIteration continues until the change in each value is less than the threshold.
-    def updateUtilities(self):
+    # Returns the max residual of each sweep.
+    def dictValueIteration(self):
+        trace = []
         terminalIteration = False
         while not terminalIteration:
             threshholdHolds = True
+            residual = 0
 
             # Each iteration of Value Iteration
             # U_i+1 <- R(s) + gamma * max a in A(s)}( sum{s' caused by a} P(s'|s,a) * U_i(s')
@@ -274,9 +402,12 @@ class Map():
                 # If any of the utilities have changed by more than the Threshold we do another iteration
                 if abs(utility - node.utility) > MDPValues.Threshold:
                     threshholdHolds = False
+                residual = max(residual, abs(utility - node.utility))
                 node.utility = utility
 
+            trace.append(residual)
             terminalIteration = threshholdHolds
+        return trace
 
 
     # Adds food rewards to map
@@ -317,6 +448,8 @@ class Map():
                     for secondNeighbor in node.connected:
                         if secondNeighbor not in seen:
                             secondNeighbor.setPunishment(MapValues.NullPunishmentValue)
+                            self._changed.add(secondNeighbor.position)
+        self._changed.update([node.position for node in seen])
 
     # Calculates the optimal move out of the legal actions - needs to be run after updateUtilities.
     def optimalMove(self, position, legal):
@@ -333,6 +466,253 @@ class Map():
         return optimalMoves[0][0]
 
 
+# A compiled form of the transition function P(s'|s, a) over a dense index of the open squares.
+# Built once per game from Node.directionProbabilities, after which Value Iteration only needs lists of floats.
+class TransitionModel():
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.index = dict((node.position, i) for i, node in enumerate(nodes))
+        # For each state, a list with one entry per legal action, each a list of (s', P(s'|s, a)) pairs.
+        # The pairs are kept in the order of the dict they came from, so that sums are added up in the same order.
+        self.transitions = []
+        for node in nodes:
+            actions = []
+            for action in node.legalDirections():
+                distribution = node.probabilities(action)
+                actions.append([(self.index[state], distribution[state]) for state in distribution.keys()])
+            self.transitions.append(actions)
+        # The 4-neighbours of each state, used to order sweeps by distance
+        self.neighbors = [[self.index[neighbor.position] for neighbor in node.connected] for node in nodes]
+        # Sweep orders that do not depend on Pacman's position
+        self._mapOrder = range(len(nodes))
+        self._redBlackOrder = [i for i, node in enumerate(nodes) if sum(node.position) % 2 == 0] + \
+                              [i for i, node in enumerate(nodes) if sum(node.position) % 2 == 1]
+        # For each state s', the states s that can reach it, with the largest P(s'|s, a) of doing so.
+        # Used by prioritisedSweep to bound how much a change in U(s') can change the backup of s.
+        self.predecessors = [dict() for node in nodes]
+        for i, actions in enumerate(self.transitions):
+            for action in actions:
+                for (j, probability) in action:
+                    if probability > self.predecessors[j].get(i, 0):
+                        self.predecessors[j][i] = probability
+        self._tensor = None
+        self._rewards = None # The rewards the utilities were last solved for - None until the first full solve
+        self._residuals = [0.0 for node in nodes] # Upper bounds on |B(U)(s) - U(s)|, kept by prioritisedSweep
+        self._policy = None # The last policy found by the policy solvers, as an index into each state's actions
+        self.backups = 0 # The number of Bellman backups done by the last solve
+        self.trace = [] # The max residual of each sweep of the last solve
+
+    # The order in which a sweep visits the states for the given schedule
+    def sweepOrder(self, schedule, position=None):
+        if schedule == Schedules.RedBlack:
+            return self._redBlackOrder
+        if schedule == Schedules.Distance and position in self.index:
+            return self.distanceOrder(self.index[position])
+        return self._mapOrder
+
+    # Breadth first search from state start, giving every reachable state nearest first. States that can't be
+    # reached are swept last.
+    def distanceOrder(self, start):
+        order = [start]
+        seen = set(order)
+        for i in order:
+            for neighbor in self.neighbors[i]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    order.append(neighbor)
+        if len(order) < len(self.nodes):
+            order += [i for i in self._mapOrder if i not in seen]
+        return order
+
+    # Value Iteration over the dense index, visiting the states in order (map order by default).
+    # In place (Gauss-Seidel) unless jacobi is set, in which case every sweep reads the previous sweep's utilities.
+    # U_i+1 <- R(s) + gamma * max a in A(s)}( sum{s' caused by a} P(s'|s,a) * U_i(s')
+    def valueIteration(self, rewards, utilities, order=None, jacobi=False):
+        gamma = MDPValues.Gamma
+        threshold = MDPValues.Threshold
+        transitions = self.transitions
+        if order is None:
+            order = self._mapOrder
+        self.backups = 0
+        self.trace = []
+        terminalIteration = False
+        while not terminalIteration:
+            previous = list(utilities) if jacobi else utilities
+            residual = 0
+            for i in order:
+                utility = rewards[i] + gamma * max(
+                    [sum([probability * previous[j] for (j, probability) in action]) for action in transitions[i]])
+                if abs(utility - utilities[i]) > residual:
+                    residual = abs(utility - utilities[i])
+                utilities[i] = utility
+            self.backups += len(order)
+            self.trace.append(residual)
+            terminalIteration = residual <= threshold
+        return utilities
+
+    # A single Bellman backup of state i
+    def backup(self, i, rewards, utilities):
+        return rewards[i] + MDPValues.Gamma * max(
+            [sum([probability * utilities[j] for (j, probability) in action]) for action in self.transitions[i]])
+
+    # How far the utility of each state is from its own backup, |B(U)(s) - U(s)|
+    def bellmanResiduals(self, rewards, utilities):
+        return [abs(self.backup(i, rewards, utilities) - utilities[i]) for i in self._mapOrder]
+
+    # Warm-started, incremental Value Iteration (prioritised sweeping).
+    # Each state keeps an upper bound on how far its utility is from its own backup. A change in reward, or in the
+    # utility of a successor, raises that bound, and only states whose bound goes over the threshold are queued -
+    # largest bound first. Backing a state up resets its bound, and the change is propagated to its predecessors.
+    # The first call (no previous solve to start from) falls back to a full sweep, which stops with every state
+    # within the threshold of its backup but not at it, so the bounds start from the residuals it leaves.
+    # Only states in changed can have a different reward from the last call.
+    def prioritisedSweep(self, rewards, utilities, changed, order=None, jacobi=False):
+        if self._rewards is None:
+            utilities = self.valueIteration(rewards, utilities, order, jacobi)
+            self._rewards = list(rewards)
+            self._residuals = self.bellmanResiduals(rewards, utilities)
+            self.backups += len(self.nodes)
+            return utilities
+        gamma = MDPValues.Gamma
+        threshold = MDPValues.Threshold
+        residuals = self._residuals
+        queue = util.LazyPriorityQueue()
+        for i in changed:
+            residuals[i] += abs(rewards[i] - self._rewards[i])
+            self._rewards[i] = rewards[i]
+            if residuals[i] > threshold:
+                queue.update(i, -residuals[i])
+        self.backups = 0
+        self.trace = []
+        while not queue.isEmpty():
+            i = queue.pop()
+            utility = self.backup(i, rewards, utilities)
+            self.backups += 1
+            delta = abs(utility - utilities[i])
+            utilities[i] = utility
+            residuals[i] = 0.0
+            for predecessor, probability in self.predecessors[i].iteritems():
+                residuals[predecessor] += gamma * probability * delta
+                if residuals[predecessor] > threshold:
+                    queue.update(predecessor, -residuals[predecessor])
+        return utilities
+
+    # The index of the action with the highest expected utility in state i, along with its backed up utility
+    def greedyAction(self, i, rewards, utilities):
+        actionUtilities = [sum([probability * utilities[j] for (j, probability) in action])
+                           for action in self.transitions[i]]
+        best = max(actionUtilities)
+        return actionUtilities.index(best), rewards[i] + MDPValues.Gamma * best
+
+    # Iterative policy evaluation - solves U(s) = R(s) + gamma * sum{s'} P(s'|s,policy(s)) * U(s') for the fixed
+    # policy by in-place sweeps, until no utility changes by more than the Threshold or maxSweeps have been done.
+    def policyEvaluation(self, rewards, utilities, policy, order, maxSweeps=None):
+        gamma = MDPValues.Gamma
+        transitions = self.transitions
+        sweeps = 0
+        residual = MDPValues.Threshold + 1
+        while residual > MDPValues.Threshold and (maxSweeps is None or sweeps < maxSweeps):
+            residual = 0
+            for i in order:
+                utility = rewards[i] + gamma * sum(
+                    [probability * utilities[j] for (j, probability) in transitions[i][policy[i]]])
+                if abs(utility - utilities[i]) > residual:
+                    residual = abs(utility - utilities[i])
+                utilities[i] = utility
+            sweeps += 1
+            self.backups += len(order)
+            self.trace.append(residual)
+        return utilities
+
+    # Policy Iteration, starting from last round's policy (or the greedy policy for the first round).
+    # The policy is evaluated until it converges, then each state switches to its greedy action if that is strictly
+    # better, until no state switches. Every evaluation runs to convergence, so this takes about three times the backups
+    # of valueIteration - modifiedPolicyIteration caps the evaluation sweeps instead.
+    def policyIteration(self, rewards, utilities, order=None):
+        if order is None:
+            order = self._mapOrder
+        self.backups = 0
+        self.trace = []
+        if self._policy is None:
+            self._policy = [self.greedyAction(i, rewards, utilities)[0] for i in self._mapOrder]
+        policy = self._policy
+        stable = False
+        while not stable:
+            self.policyEvaluation(rewards, utilities, policy, order)
+            stable = True
+            for i in order:
+                action, utility = self.greedyAction(i, rewards, utilities)
+                current = sum([probability * utilities[j] for (j, probability) in self.transitions[i][policy[i]]])
+                if rewards[i] + MDPValues.Gamma * current < utility:
+                    policy[i] = action
+                    stable = False
+            self.backups += len(order)
+        return utilities
+
+    # Modified Policy Iteration - each Bellman backup sweep picks the greedy policy, which is then evaluated for only
+    # EvaluationSweeps sweeps. Stops on the same threshold as Value Iteration, tested on the Bellman backup sweep.
+    def modifiedPolicyIteration(self, rewards, utilities, order=None):
+        if order is None:
+            order = self._mapOrder
+        self.backups = 0
+        self.trace = []
+        if self._policy is None:
+            self._policy = [0 for i in self._mapOrder]
+        policy = self._policy
+        terminalIteration = False
+        while not terminalIteration:
+            residual = 0
+            for i in order:
+                policy[i], utility = self.greedyAction(i, rewards, utilities)
+                if abs(utility - utilities[i]) > residual:
+                    residual = abs(utility - utilities[i])
+                utilities[i] = utility
+            self.backups += len(order)
+            self.trace.append(residual)
+            terminalIteration = residual <= MDPValues.Threshold
+            if not terminalIteration:
+                self.policyEvaluation(rewards, utilities, policy, order, MDPValues.EvaluationSweeps)
+        return utilities
+
+    # Lazy initialises the (actions x states x successors) tensor used by batchedValueIteration.
+    # Padding entries point at state 0 with probability 0, and missing actions are masked out with -inf.
+    def tensor(self):
+        if self._tensor is None:
+            numActions = max([len(actions) for actions in self.transitions])
+            numSuccessors = max([len(action) for actions in self.transitions for action in actions])
+            successors = numpy.zeros((numActions, len(self.nodes), numSuccessors), dtype=int)
+            probabilities = numpy.zeros((numActions, len(self.nodes), numSuccessors))
+            mask = numpy.full((numActions, len(self.nodes)), -numpy.inf)
+            for i, actions in enumerate(self.transitions):
+                for a, action in enumerate(actions):
+                    mask[a, i] = 0
+                    for k, (j, probability) in enumerate(action):
+                        successors[a, i, k] = j
+                        probabilities[a, i, k] = probability
+            self._tensor = (successors, probabilities, mask)
+        return self._tensor
+
+    # Synchronous (Jacobi) Value Iteration, where every sweep is a batch of matrix-vector products followed by a max
+    # over actions. Stops on the same threshold as valueIteration, so converges to the same utilities within it.
+    def batchedValueIteration(self, rewards, utilities):
+        successors, probabilities, mask = self.tensor()
+        rewards = numpy.array(rewards)
+        utilities = numpy.array(utilities)
+        self.backups = 0
+        self.trace = []
+        terminalIteration = False
+        while not terminalIteration:
+            actionUtilities = (probabilities * utilities[successors]).sum(axis=2) + mask
+            updated = rewards + MDPValues.Gamma * actionUtilities.max(axis=0)
+            residual = numpy.abs(updated - utilities).max()
+            utilities = updated
+            self.backups += len(self.nodes)
+            self.trace.append(float(residual))
+            terminalIteration = residual <= MDPValues.Threshold
+        return utilities.tolist()
+
+
 # A class to assist with converting between locations and directions.
 # Given any two of position, nextPosition and direction, can generate the third.
 class DirectionalLocation():
@@ -0,0 +1,152 @@
+# mdpBenchmark.py
+#
+# Compares the solvers, backends and sweep schedules of mdpAgents.MDPAgent on the bundled layouts.
+#
+# For each layout and configuration, plays the same seeded games with no graphics and reports the wall time per
+# move spent in getAction, the number of Bellman backups per move and the number of sweeps per move.
+# With --check, also solves every move again to convergence and checks that the agent's utilities were within
+# Threshold / (1 - Gamma) of it, reporting the largest difference.
+#
+#   python mdpBenchmark.py
+#   python mdpBenchmark.py -l mediumClassic,originalClassic -n 5 -s value,policy,modified
+#   python mdpBenchmark.py -c backend=numpy -c backend=incremental -c schedule=red-black
+#   python mdpBenchmark.py -l mediumClassic -s value -c backend=incremental --check
+
+import os
+import random
+import sys
+import time
+
+import ghostAgents
+import layout
+import mdpAgents
+import pacman
+import textDisplay
+import util
+
+
+# Raised to end games that go on for longer than the move limit
+class MoveLimitException(Exception):
+    pass
+
+
+# Raised when a solver's utilities are further from the converged utilities than its threshold allows
+class CheckFailedException(Exception):
+    pass
+
+
+# An MDPAgent that keeps the wall time of each getAction call, and gives up after maxMoves moves.
+# With check set, keeps how far the utilities of each move were from the converged ones, outside the timing.
+class TimedMDPAgent(mdpAgents.MDPAgent):
+
+    def __init__(self, maxMoves, check=False, **args):
+        mdpAgents.MDPAgent.__init__(self, **args)
+        self.maxMoves = maxMoves
+        self.check = check
+        self.moveTimes = []
+        self.errors = []
+
+    def getAction(self, state):
+        if len(self.moveTimes) >= self.maxMoves:
+            raise MoveLimitException()
+        start = time.time()
+        action = mdpAgents.MDPAgent.getAction(self, state)
+        self.moveTimes.append(time.time() - start)
+        if self.check:
+            self.errors.append(self.map.fixedPointError())
+        return action
+
+
+# Plays numGames seeded games of the given configuration on the layout, returning the totals across all of them
+# Games that reach maxMoves are counted as losses.
+def benchmark(layoutName, configuration, numGames, numGhosts, timeout, maxMoves, check=False):
+    lay = layout.getLayout(layoutName)
+    rules = pacman.ClassicGameRules(timeout)
+    totals = {'wins': 0, 'unfinished': 0, 'moves': 0, 'time': 0.0, 'backups': 0, 'sweeps': 0, 'error': 0.0}
+    for i in range(numGames):
+        # Every configuration plays the same games
+        random.seed('%s-%d' % (layoutName, i))
+        util.mutePrint()
+        try:
+            agent = TimedMDPAgent(maxMoves, check, **configuration)
+            ghosts = [ghostAgents.RandomGhost(index + 1) for index in range(numGhosts)]
+            game = rules.newGame(lay, agent, ghosts, textDisplay.NullGraphics(), True)
+            game.run()
+            totals['wins'] += int(game.state.isWin())
+        except MoveLimitException:
+            totals['unfinished'] += 1
+        finally:
+            util.unmutePrint()
+        totals['moves'] += len(agent.moveTimes)
+        totals['time'] += sum(agent.moveTimes)
+        totals['backups'] += sum(agent.map.getBackups())
+        totals['sweeps'] += sum([len(trace) for trace in agent.map.getTraces()])
+        totals['error'] = max([totals['error']] + agent.errors)
+    bound = mdpAgents.MDPValues.Threshold / (1 - mdpAgents.MDPValues.Gamma)
+    if totals['error'] > bound:
+        raise CheckFailedException('utilities were %.4f from converged, more than the bound of %.4f'
+                                   % (totals['error'], bound))
+    return totals
+
+
+def readCommand(argv):
+    from optparse import OptionParser
+    parser = OptionParser("python mdpBenchmark.py <options>")
+    parser.add_option('-l', '--layouts', dest='layouts', default=None,
+                      help='Comma separated layouts to benchmark [Default: every layout in layouts/]')
+    parser.add_option('-s', '--solvers', dest='solvers', default='value,policy,modified',
+                      help='Comma separated solvers to compare [Default: %default]')
+    parser.add_option('-c', '--configuration', dest='configurations', action='append', default=[],
+                      help='Extra agent arguments to compare, e.g. "backend=numpy" - may be given more than once')
+    parser.add_option('-n', '--numGames', dest='numGames', type='int', default=1,
+                      help='The number of games per layout and configuration [Default: %default]')
+    parser.add_option('-k', '--numghosts', dest='numGhosts', type='int', default=4,
+                      help='The maximum number of ghosts to use [Default: %default]')
+    parser.add_option('-m', '--maxMoves', dest='maxMoves', type='int', default=2000,
+                      help='Games still running after this many Pacman moves count as losses [Default: %default]')
+    parser.add_option('--timeout', dest='timeout', type='int', default=30,
+                      help='Maximum length of time an agent can spend computing in a single game [Default: %default]')
+    parser.add_option('--check', dest='check', action='store_true', default=False,
+                      help='Check every move\'s utilities against a solve to convergence, and report the largest error')
+    options, otherjunk = parser.parse_args(argv)
+    if len(otherjunk) != 0:
+        raise Exception('Command line input not understood: ' + str(otherjunk))
+    if options.layouts is None:
+        layoutDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts')
+        options.layouts = ','.join(sorted([f[:-4] for f in os.listdir(layoutDir) if f.endswith('.lay')]))
+    configurations = [('solver=' + solver, {'solver': solver}) for solver in options.solvers.split(',') if solver]
+    configurations += [(text, pacman.parseAgentArgs(text)) for text in options.configurations]
+    return options.layouts.split(','), configurations, options
+
+
+def runBenchmark(layoutNames, configurations, options):
+    header = '%-22s %-34s %7s %10s %7s %10s %12s %10s' % (
+        'Layout', 'Configuration', 'Wins', 'Unfinished', 'Moves', 'ms/move', 'backups/move', 'sweeps/move')
+    if options.check:
+        header += ' %10s' % 'max error'
+    print header
+    for layoutName in layoutNames:
+        for name, configuration in configurations:
+            try:
+                totals = benchmark(layoutName, configuration, options.numGames, options.numGhosts, options.timeout,
+                                   options.maxMoves, options.check)
+            except CheckFailedException, e:
+                print '%-22s %-34s check failed: %s' % (layoutName, name, e)
+                continue
+            except Exception, e:
+                # Some layouts can't be played by MDPAgent at all (eg. open squares with no neighbours)
+                print '%-22s %-34s crashed: %s' % (layoutName, name, e)
+                continue
+            moves = max(totals['moves'], 1)
+            row = '%-22s %-34s %3d/%-3d %10d %7d %10.2f %12.1f %10.2f' % (
+                layoutName, name, totals['wins'], options.numGames, totals['unfinished'], totals['moves'],
+                1000 * totals['time'] / moves, totals['backups'] / float(moves), totals['sweeps'] / float(moves))
+            if options.check:
+                row += ' %10.4f' % totals['error']
+            print row
+            sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    layoutNames, configurations, options = readCommand(sys.argv[1:])
+    runBenchmark(layoutNames, configurations, options)
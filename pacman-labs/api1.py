@@ -76,7 +76,7 @@ def food(state):
     height = foodGrid.height
     for i in range(width):
         for j in range(height):
-            if foodGrid[i][j] == True:
+            if foodGrid.get(i, j) == True:
                 foodList.append((i, j))            
     return foodList
 
@@ -31,6 +31,7 @@
 # the PacMan AI projects.
 
 from pacman import Directions
+from game import gridAdjacency
 import util
 
 sideLimit = 1
@@ -106,12 +107,12 @@ def food(state):
 
     foodList = []
     foodGrid = state.getFood()
-    width = foodGrid.width
-    height = foodGrid.height
-    for i in range(width):
-        for j in range(height):
-            if foodGrid[i][j] == True:
-                foodList.append((i, j))
+
+    # Only the squares Pacman can see need checking. Sorting them
+    # keeps the food in the same order as scanning the whole grid.
+    for (i, j) in sorted(visibleSquares(state)):
+        if foodGrid.get(i, j) == True:
+            foodList.append((i, j))
 
     # Return list of food that is visible
     return visible(foodList, state)
@@ -135,6 +136,17 @@ def walls(state):
     return wallList
 
 
+def adjacency(state):
+    # Returns a dictionary mapping the (x, y) of each square that is
+    # not a wall to a tuple of the (x, y) pairs of its neighbours, the
+    # squares North, South, East and West of it that are not walls.
+    #
+    # This is built straight from the wall grid in a single pass, so
+    # it is much cheaper than comparing every square against walls().
+
+    return gridAdjacency(state.getWalls())
+
+
 def corners(state):
     # Returns the coordinates of the four corners of the state space.
     #
@@ -183,59 +195,11 @@ def inFront(object, facing, state):
     # Returns true if the object is along the corridor in the
     # direction of the parameter "facing" before a wall gets in the
     # way.
+    #
+    # The squares along each corridor are worked out once per layout
+    # (see Visibility in layout.py), so this is a single lookup.
 
-    pacman = state.getPacmanPosition()
-    pacman_x = pacman[0]
-    pacman_y = pacman[1]
-    wallList = walls(state)
-
-    # If Pacman is facing North
-    if facing == Directions.NORTH:
-        # Check if the object is anywhere due North of Pacman before a
-        # wall intervenes.
-        next = (pacman_x, pacman_y + 1)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (pacman_x, next[1] + 1)
-        return False
-
-    # If Pacman is facing South
-    if facing == Directions.SOUTH:
-        # Check if the object is anywhere due North of Pacman before a
-        # wall intervenes.
-        next = (pacman_x, pacman_y - 1)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (pacman_x, next[1] - 1)
-        return False
-
-    # If Pacman is facing East
-    if facing == Directions.EAST:
-        # Check if the object is anywhere due East of Pacman before a
-        # wall intervenes.
-        next = (pacman_x + 1, pacman_y)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (next[0] + 1, pacman_y)
-        return False
-
-    # If Pacman is facing West
-    if facing == Directions.WEST:
-        # Check if the object is anywhere due West of Pacman before a
-        # wall intervenes.
-        next = (pacman_x - 1, pacman_y)
-        while not next in wallList:
-            if next == object:
-                return True
-            else:
-                next = (next[0] - 1, pacman_y)
-        return False
+    return object in state.getVisibleCells(state.getPacmanPosition(), facing)
 
 
 def atSide(object, facing, state):
@@ -275,46 +239,47 @@ def visible(objects, state):
     # When passed a list of objects, returns those that are visible to
     # Pacman.
 
+    pacman = state.getPacmanPosition()
     facing = state.getPacmanState().configuration.direction
-    visibleObjects = []
-    sideObjects = []
 
     if facing != Directions.STOP:
 
         # If Pacman is moving, visible objects are those in front of,
         # and to the side (if there are any side corridors).
-
-        # Objects in front. Visible up to "visibilityLimit"
-        for i in range(len(objects)):
-            if inFront(objects[i], facing, state):
-                visibleObjects.append(objects[i])
-        visibleObjects = distanceLimited(visibleObjects, state, visibilityLimit)
-
-        # Objects to the side. Visible up to "sideLimit"
-        for i in range(len(objects)):
-            if atSide(objects[i], facing, state):
-                sideObjects.append(objects[i])
-        sideObjects = distanceLimited(sideObjects, state, sideLimit)
+        #
+        # Objects in front are visible up to "visibilityLimit", those
+        # to the side up to "sideLimit".
+        front = state.getVisibleCells(pacman, facing, visibilityLimit)
+        side = state.getVisibleCells(pacman, Directions.LEFT[facing], sideLimit) | \
+               state.getVisibleCells(pacman, Directions.RIGHT[facing], sideLimit)
 
         # Combine lists.
-        visibleObjects = visibleObjects + sideObjects
+        return [o for o in objects if o in front] + [o for o in objects if o in side]
 
     else:
 
         # If Pacman is not moving, they can see in all directions.
+        around = visibleSquares(state)
+        return [o for o in objects if o in around]
+
+
+def visibleSquares(state):
+    # Returns the set of (x, y) squares that Pacman can see, whatever
+    # is in them. Used to look for objects in just these squares
+    # rather than across the whole grid.
+
+    pacman = state.getPacmanPosition()
+    facing = state.getPacmanState().configuration.direction
 
-        for i in range(len(objects)):
-            if inFront(objects[i], Directions.NORTH, state):
-                visibleObjects.append(objects[i])
-            if inFront(objects[i], Directions.SOUTH, state):
-                visibleObjects.append(objects[i])
-            if inFront(objects[i], Directions.EAST, state):
-                visibleObjects.append(objects[i])
-            if inFront(objects[i], Directions.WEST, state):
-                visibleObjects.append(objects[i])
-        visibleObjects = distanceLimited(visibleObjects, state, visibilityLimit)
-
-    return visibleObjects
+    if facing != Directions.STOP:
+        return state.getVisibleCells(pacman, facing, visibilityLimit) | \
+               state.getVisibleCells(pacman, Directions.LEFT[facing], sideLimit) | \
+               state.getVisibleCells(pacman, Directions.RIGHT[facing], sideLimit)
+    else:
+        around = set()
+        for direction in [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST]:
+            around |= state.getVisibleCells(pacman, direction, visibilityLimit)
+        return around
 
 
 def audible(ghosts, state):
@@ -19,6 +19,7 @@ import optparse
 import os
 import re
 import sys
+import time
 import projectParams
 import random
 random.seed(0)
@@ -79,6 +80,21 @@ def readCommand(argv):
                     dest = 'noGraphics',
                     action = 'store_true',
                     help = 'No graphics display for pacman games.')
+    parser.add_option('--jobs', '-j',
+                    dest = 'jobs',
+                    type = 'int',
+                    default = 1,
+                    help = 'Run test cases in this many processes at once.')
+    parser.add_option('--cpu-limit',
+                    dest = 'cpuLimit',
+                    type = 'float',
+                    default = None,
+                    help = 'Run each test case in a worker process, with at most this many seconds of CPU time.')
+    parser.add_option('--memory-limit',
+                    dest = 'memoryLimit',
+                    type = 'int',
+                    default = None,
+                    help = 'Run test cases in worker processes of at most this many megabytes of address space.')
     (options, args) = parser.parse_args(argv)
     return options
 
@@ -243,10 +259,156 @@ def getTestSubdirs(testParser, testRoot, questionToGrade):
     return sorted(os.listdir(testRoot))
 
 
+# test case functions for worker processes to run, keyed by (question, index).
+# filled in before the workers are started, so that they inherit them.
+PARALLEL_TESTS = {}
+
+# runs a test case in a worker process, recording what it does to the grades
+# rather than doing it.  if the test case raises, the recording stops there,
+# and the type, message and traceback of the exception are returned with it.
+def runRecordedTest(key):
+    recorder = grading.GradesRecorder()
+    stdout = sys.stdout
+    sys.stdout = recorder
+    start = time.time()
+    error = None
+    result = None
+    try:
+        try:
+            result = PARALLEL_TESTS[key](recorder)
+        except Exception:
+            error = grading.describeException()
+        except:
+            error = (None, 'Terminated with a string exception.', None)
+    finally:
+        sys.stdout = stdout
+    return recorder, result, start, time.time(), error
+
+
+class ParallelGrader:
+    """
+    Runs the test cases of every question in a grading.WorkerPool, and replays
+    what each one did into the grades when grading.Grades.grade gets to it, so
+    that the output is the same as running them one after another.  With one
+    job and no limits there is no pool, and each test case is simply run when
+    it comes up.
+
+    A question that depends on others only has its test cases started once the
+    questions it depends on are complete, since Grades.grade skips it otherwise.
+
+    With a CPU time or memory limit, no test case runs in the grader itself: one
+    that raises has its exception reported from the worker, and one that
+    overruns fails its question.  Without limits, a test case that raised is run
+    again in the grader, so that the traceback it reports is the one it always
+    would.
+    """
+    def __init__(self, jobs, cpuLimit=None, memoryLimit=None):
+        self.jobs = jobs
+        self.cpuLimit = cpuLimit
+        self.memoryLimit = memoryLimit
+        self.testCases = {}
+        self.questions = []
+        self.prereqs = {}
+        self.completed = set()
+        self.submitted = {}
+        self.times = {}
+        self.pool = None
+
+    def isLimited(self):
+        return self.cpuLimit != None or self.memoryLimit != None
+
+    def addTestCase(self, q, thunk):
+        "Adds thunk to the test cases of question q, returning the function that replays it."
+        if q not in self.testCases:
+            self.testCases[q] = []
+            self.questions.append(q)
+        i = len(self.testCases[q])
+        self.testCases[q].append(thunk)
+        return lambda grades: self.runTest(q, i, grades)
+
+    def makeQuestion(self, q, question):
+        return lambda grades: self.runQuestion(q, question, grades)
+
+    def start(self, prereqs):
+        PARALLEL_TESTS.clear()
+        for q in self.questions:
+            for i, thunk in enumerate(self.testCases[q]):
+                PARALLEL_TESTS[(q, i)] = thunk
+        self.prereqs = prereqs
+        if self.jobs <= 1 and not self.isLimited():
+            # run every test case in this process, when grading gets to it
+            return
+        self.pool = grading.WorkerPool(self.jobs, runRecordedTest, self.cpuLimit, self.memoryLimit)
+        self.pool.start()
+        for q in self.questions:
+            if not self.prereqs.get(q):
+                self.submit(q)
+
+    def submit(self, q):
+        if q in self.submitted or self.pool == None:
+            return
+        self.submitted[q] = time.time()
+        for i in range(len(self.testCases[q])):
+            self.pool.submit((q, i))
+
+    def runTest(self, q, i, grades):
+        self.submit(q)
+        outcome = None
+        if q in self.submitted:
+            try:
+                outcome = self.pool.get((q, i))
+            except grading.WorkerException:
+                # what the test case returned couldn't be sent back
+                if self.isLimited(): raise
+            except grading.WorkerTerminated:
+                self.addTime(q, self.submitted[q], time.time())
+                raise
+        if outcome == None or (outcome[4] != None and not self.isLimited()):
+            start = time.time()
+            result = self.testCases[q][i](grades)
+            end = time.time()
+            error = None
+        else:
+            recorder, result, start, end, error = outcome
+            recorder.replay(grades)
+        self.addTime(q, start, end)
+        if error != None:
+            typeName, message, tracebackText = error
+            if tracebackText == None:
+                raise grading.WorkerTerminated(message)
+            raise grading.WorkerException(message, typeName, tracebackText)
+        return result
+
+    def addTime(self, q, start, end):
+        first, last = self.times.get(q, (start, end))
+        self.times[q] = (min(first, start), max(last, end))
+
+    def runQuestion(self, q, question, grades):
+        question.execute(grades)
+        if grades.points[q] >= grades.maxes[q]:
+            self.completed.add(q)
+            for other in self.questions:
+                if self.prereqs.get(other) and self.prereqs[other] <= self.completed:
+                    self.submit(other)
+
+    def close(self):
+        if self.pool != None:
+            self.pool.close()
+            self.pool = None
+
+    def printTimes(self):
+        "Prints the wall clock time from the first test case of each question starting to the last finishing."
+        for q in self.questions:
+            if q in self.times:
+                first, last = self.times[q]
+                print >>sys.stderr, 'Question %s: %.2fs' % (q, last - first)
+
+
 # evaluate student code
 def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MAP,
              edxOutput=False, muteOutput=False, gsOutput=False,
-            printTestCase=False, questionToGrade=None, display=None):
+            printTestCase=False, questionToGrade=None, display=None, jobs=1,
+            cpuLimit=None, memoryLimit=None):
     # imports of testbench code.  note that the testClasses import must follow
     # the import of student code due to dependencies
     import testParser
@@ -256,6 +418,9 @@ def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MA
 
     questions = []
     questionDicts = {}
+    if memoryLimit != None:
+        memoryLimit = memoryLimit * 1024 * 1024
+    parallel = ParallelGrader(jobs, cpuLimit, memoryLimit)
     test_subdirs = getTestSubdirs(testParser, testRoot, questionToGrade)
     for q in test_subdirs:
         subdir_path = os.path.join(testRoot, q)
@@ -281,34 +446,43 @@ def evaluate(generateSolutions, testRoot, moduleDict, exceptionMap=ERROR_HINT_MA
             testDict['test_out_file'] = test_out_file
             testClass = getattr(projectTestClasses, testDict['class'])
             testCase = testClass(question, testDict)
-            def makefun(testCase, solution_file):
+            def makefun(testCase, testDict, solution_file):
                 if generateSolutions:
                     # write solution file to disk
                     return lambda grades: testCase.writeSolution(moduleDict, solution_file)
                 else:
                     # read in solution dictionary and pass as an argument
-                    testDict = testParser.TestParser(test_file).parse()
                     solutionDict = testParser.TestParser(solution_file).parse()
                     if printTestCase:
                         return lambda grades: printTest(testDict, solutionDict) or testCase.execute(grades, moduleDict, solutionDict)
                     else:
                         return lambda grades: testCase.execute(grades, moduleDict, solutionDict)
-            question.addTestCase(testCase, makefun(testCase, solution_file))
+            question.addTestCase(testCase, parallel.addTestCase(q, makefun(testCase, testDict, solution_file)))
 
-        # Note extra function is necessary for scoping reasons
-        def makefun(question):
-            return lambda grades: question.execute(grades)
-        setattr(sys.modules[__name__], q, makefun(question))
+        setattr(sys.modules[__name__], q, parallel.makeQuestion(q, question))
         questions.append((q, question.getMaxPoints()))
 
+    # the workers limit test cases themselves, without any alarms in the grader
+    timeout = 1800
+    if parallel.isLimited():
+        timeout = None
     grades = grading.Grades(projectParams.PROJECT_NAME, questions,
-                            gsOutput=gsOutput, edxOutput=edxOutput, muteOutput=muteOutput)
+                            gsOutput=gsOutput, edxOutput=edxOutput, muteOutput=muteOutput,
+                            timeout=timeout)
     if questionToGrade == None:
         for q in questionDicts:
             for prereq in questionDicts[q].get('depends', '').split():
                 grades.addPrereq(q, prereq)
 
-    grades.grade(sys.modules[__name__], bonusPic = projectParams.BONUS_PIC)
+    start = time.time()
+    parallel.start(grades.prereqs)
+    try:
+        grades.grade(sys.modules[__name__], bonusPic = projectParams.BONUS_PIC)
+    finally:
+        parallel.close()
+    if jobs > 1 or parallel.isLimited():
+        parallel.printTimes()
+        print >>sys.stderr, 'Total: %.2fs' % (time.time() - start)
     return grades.points
 
 
@@ -355,4 +529,5 @@ if __name__ == '__main__':
         evaluate(options.generateSolutions, options.testRoot, moduleDict,
             gsOutput=options.gsOutput,
             edxOutput=options.edxOutput, muteOutput=options.muteOutput, printTestCase=options.printTestCase,
-            questionToGrade=options.gradeQuestion, display=getDisplay(options.gradeQuestion!=None, options))
+            questionToGrade=options.gradeQuestion, display=getDisplay(options.gradeQuestion!=None, options),
+            jobs=options.jobs, cpuLimit=options.cpuLimit, memoryLimit=options.memoryLimit)
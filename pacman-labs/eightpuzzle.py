@@ -14,10 +14,28 @@
 
 import search
 import random
+import array
+import collections
+import os
 
 # Module Classes
 
-class EightPuzzleState:
+# The cell the blank moves to for each move, from each cell, in the order legalMoves lists them
+MOVE_TARGETS = []
+for blank in range( 9 ):
+    row, col = divmod( blank, 3 )
+    targets = []
+    if row != 0: targets.append( ('up', blank - 3) )
+    if row != 2: targets.append( ('down', blank + 3) )
+    if col != 0: targets.append( ('left', blank - 1) )
+    if col != 2: targets.append( ('right', blank + 1) )
+    MOVE_TARGETS.append( targets )
+LEGAL_MOVES = [[move for move, target in targets] for targets in MOVE_TARGETS]
+MOVE_TARGET = [dict(targets) for targets in MOVE_TARGETS]
+
+GOAL_CODE = sum([number << (4 * number) for number in range( 9 )])
+
+class EightPuzzleState(object):
     """
     The Eight Puzzle is described in the course textbook on
     page 64.
@@ -26,6 +44,7 @@ class EightPuzzleState:
     task of recasting this puzzle as a search problem is left to
     the EightPuzzleSearchProblem class.
     """
+    __slots__ = ('code', 'blank')
 
     def __init__( self, numbers ):
         """
@@ -46,18 +65,26 @@ class EightPuzzleState:
             | 6 | 7 | 8 |
             ------------
 
-        The configuration of the puzzle is stored in a 2-dimensional
-        list (a list of lists) 'cells'.
+        The configuration of the puzzle is stored in a single integer,
+        'code', with the number in cell i (counting along the rows) in
+        bits 4i to 4i+3, and 'blank' is the cell of the blank space.
+        'cells' gives the configuration as a 2-dimensional list (a list
+        of lists).
         """
-        self.cells = []
-        numbers = numbers[:] # Make a copy so as not to cause side-effects.
-        numbers.reverse()
-        for row in range( 3 ):
-            self.cells.append( [] )
-            for col in range( 3 ):
-                self.cells[row].append( numbers.pop() )
-                if self.cells[row][col] == 0:
-                    self.blankLocation = row, col
+        self.code = 0
+        for cell, number in enumerate( numbers ):
+            self.code |= number << (4 * cell)
+        self.blank = list( numbers ).index( 0 )
+
+    def getCells( self ):
+        return [[(self.code >> (4 * (3 * row + col))) & 15 for col in range( 3 )] for row in range( 3 )]
+
+    cells = property( getCells )
+
+    def getBlankLocation( self ):
+        return divmod( self.blank, 3 )
+
+    blankLocation = property( getBlankLocation )
 
     def isGoal( self ):
         """
@@ -77,13 +104,7 @@ class EightPuzzleState:
         >>> EightPuzzleState([1, 0, 2, 3, 4, 5, 6, 7, 8]).isGoal()
         False
         """
-        current = 0
-        for row in range( 3 ):
-            for col in range( 3 ):
-                if current != self.cells[row][col]:
-                    return False
-                current += 1
-        return True
+        return self.code == GOAL_CODE
 
     def legalMoves( self ):
         """
@@ -95,17 +116,7 @@ class EightPuzzleState:
         >>> EightPuzzleState([0, 1, 2, 3, 4, 5, 6, 7, 8]).legalMoves()
         ['down', 'right']
         """
-        moves = []
-        row, col = self.blankLocation
-        if(row != 0):
-            moves.append('up')
-        if(row != 2):
-            moves.append('down')
-        if(col != 0):
-            moves.append('left')
-        if(col != 2):
-            moves.append('right')
-        return moves
+        return LEGAL_MOVES[self.blank][:]
 
     def result(self, move):
         """
@@ -113,36 +124,24 @@ class EightPuzzleState:
         updated based on the provided move.
 
         The move should be a string drawn from a list returned by legalMoves.
-        Illegal moves will raise an exception, which may be an array bounds
-        exception.
+        Illegal moves will raise an exception.
 
         NOTE: This function *does not* change the current object.  Instead,
         it returns a new object.
         """
-        row, col = self.blankLocation
-        if(move == 'up'):
-            newrow = row - 1
-            newcol = col
-        elif(move == 'down'):
-            newrow = row + 1
-            newcol = col
-        elif(move == 'left'):
-            newrow = row
-            newcol = col - 1
-        elif(move == 'right'):
-            newrow = row
-            newcol = col + 1
-        else:
-            raise "Illegal Move"
-
-        # Create a copy of the current eightPuzzle
-        newPuzzle = EightPuzzleState([0, 0, 0, 0, 0, 0, 0, 0, 0])
-        newPuzzle.cells = [values[:] for values in self.cells]
-        # And update it to reflect the move
-        newPuzzle.cells[row][col] = self.cells[newrow][newcol]
-        newPuzzle.cells[newrow][newcol] = self.cells[row][col]
-        newPuzzle.blankLocation = newrow, newcol
+        target = MOVE_TARGET[self.blank].get( move )
+        if target == None: raise Exception( "Illegal Move" )
+        return self.slide( target )
 
+    def slide( self, target ):
+        """
+          Returns the puzzle with the number in cell target slid into the
+        blank space, found with two shifts rather than by copying rows.
+        """
+        number = (self.code >> (4 * target)) & 15
+        newPuzzle = EightPuzzleState.__new__( EightPuzzleState )
+        newPuzzle.code = self.code + (number << (4 * self.blank)) - (number << (4 * target))
+        newPuzzle.blank = target
         return newPuzzle
 
     # Utilities for comparison and display
@@ -155,13 +154,13 @@ class EightPuzzleState:
               EightPuzzleState([1, 0, 2, 3, 4, 5, 6, 7, 8]).result('left')
           True
         """
-        for row in range( 3 ):
-            if self.cells[row] != other.cells[row]:
-                return False
-        return True
+        return isinstance( other, EightPuzzleState ) and self.code == other.code
+
+    def __ne__(self, other):
+        return not self == other
 
     def __hash__(self):
-        return hash(str(self.cells))
+        return hash(self.code)
 
     def __getAsciiString(self):
         """
@@ -196,7 +195,7 @@ class EightPuzzleSearchProblem(search.SearchProblem):
         self.puzzle = puzzle
 
     def getStartState(self):
-        return puzzle
+        return self.puzzle
 
     def isGoalState(self,state):
         return state.isGoal()
@@ -208,8 +207,8 @@ class EightPuzzleSearchProblem(search.SearchProblem):
           from the original state and the cost is 1.0 for each
         """
         succ = []
-        for a in state.legalMoves():
-            succ.append((state.result(a), a, 1))
+        for a, target in MOVE_TARGETS[state.blank]:
+            succ.append((state.slide(target), a, 1))
         return succ
 
     def getCostOfActions(self, actions):
@@ -262,6 +261,239 @@ def createRandomEightPuzzle(moves=100):
         puzzle = puzzle.result(random.sample(puzzle.legalMoves(), 1)[0])
     return puzzle
 
+# Exact distances and pattern databases
+
+EIGHT_PUZZLE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.distances')
+
+def getIndex(state):
+    """
+      Returns the place of a solvable puzzle in a table of all 181,440 of
+    them: the cell of the blank, then the order of the numbers 1 to 8.
+    Only the first six of those are needed, since solvable puzzles are
+    the ones where that order is an even permutation, which leaves one
+    way of placing the last two.
+    """
+    code = state.code
+    unused = 0x1FE   # Bit n is set while number n has not been seen
+    index = 0
+    radix = 8
+    for cell in range( 9 ):
+        number = (code >> (4 * cell)) & 15
+        if number == 0: continue
+        # The rank of number among the numbers not seen yet
+        index = index * radix + bin( unused & ((1 << number) - 1) ).count( '1' )
+        unused &= ~(1 << number)
+        radix -= 1
+        if radix == 2: break
+    return state.blank * 20160 + index
+
+class EightPuzzleDistances:
+    """
+      The number of moves from every solvable eight puzzle to the goal,
+    found with one breadth first search back from the goal and stored as
+    one byte per puzzle, indexed by getIndex.
+
+    The table is saved in cacheDir, so later runs load it from disk
+    instead of searching again.
+    """
+    SIZE = 181440
+    UNKNOWN = 255
+
+    def __init__(self, cacheDir=EIGHT_PUZZLE_CACHE_DIR):
+        self.cacheFile = os.path.join(cacheDir, 'eightpuzzle.dist')
+        self.distances = loadTable(self.cacheFile, EightPuzzleDistances.SIZE)
+        if self.distances is None:
+            self.distances = self.compute()
+            saveTable(self.cacheFile, self.distances)
+
+    def compute(self):
+        distances = array.array('B', [EightPuzzleDistances.UNKNOWN]) * EightPuzzleDistances.SIZE
+        goal = EightPuzzleState(range( 9 ))
+        distances[getIndex(goal)] = 0
+        frontier = [goal]
+        depth = 0
+        while frontier:
+            depth += 1
+            nextFrontier = []
+            for puzzle in frontier:
+                for move, target in MOVE_TARGETS[puzzle.blank]:
+                    child = puzzle.slide(target)
+                    index = getIndex(child)
+                    if distances[index] == EightPuzzleDistances.UNKNOWN:
+                        distances[index] = depth
+                        nextFrontier.append(child)
+            frontier = nextFrontier
+        return distances
+
+    def getDistance(self, state):
+        """
+          Returns the fewest moves that solve state, or None if it can't be solved.
+        """
+        if not isSolvable(state): return None
+        return self.distances[getIndex(state)]
+
+    def solve(self, state):
+        """
+          Returns a shortest list of moves that solves state, found by
+        always taking a move that gets one closer, with no searching.
+        """
+        distance = self.getDistance(state)
+        if distance == None: raise Exception("The puzzle can't be solved")
+        moves = []
+        while distance > 0:
+            for move, target in MOVE_TARGETS[state.blank]:
+                child = state.slide(target)
+                if self.distances[getIndex(child)] == distance - 1: break
+            moves.append(move)
+            state = child
+            distance -= 1
+        return moves
+
+def isSolvable(state):
+    "Returns whether the numbers 1 to 8 are in an even permutation, which is what makes a puzzle solvable."
+    numbers = [(state.code >> (4 * cell)) & 15 for cell in range( 9 ) if cell != state.blank]
+    inversions = 0
+    for i in range( len(numbers) ):
+        for j in range( i + 1, len(numbers) ):
+            if numbers[i] > numbers[j]: inversions += 1
+    return inversions % 2 == 0
+
+class PatternDatabase:
+    """
+      The fewest moves of the numbers in pattern needed to put them in
+    their goal cells, whatever happens to the other numbers, for every
+    arrangement of them and the blank.  It is found with a breadth first
+    search back from the goal in which moving any other number costs
+    nothing.
+
+    Since only the moves of numbers in the pattern are counted, the
+    values of databases whose patterns don't overlap can be added up
+    and still never overestimate the moves needed.  Keeping the blank
+    in the arrangement, rather than taking the best case over where it
+    is, makes the sum consistent as well, as graph search needs.  The
+    table is indexed by the cells of the numbers and then the blank in
+    base 9, one byte each, and saved in cacheDir like
+    EightPuzzleDistances.
+    """
+    def __init__(self, pattern, cacheDir=EIGHT_PUZZLE_CACHE_DIR):
+        self.pattern = tuple(pattern)
+        self.size = 9 ** (len(self.pattern) + 1)
+        name = 'eightpuzzle-%s.pdb' % '-'.join([str(number) for number in self.pattern])
+        self.cacheFile = os.path.join(cacheDir, name)
+        self.distances = loadTable(self.cacheFile, self.size)
+        if self.distances is None:
+            self.distances = self.compute()
+            saveTable(self.cacheFile, self.distances)
+
+    def compute(self):
+        # Search over the cells of the pattern's numbers and the blank, by
+        # breadth first search with zero cost moves put on the front of the queue
+        unknown = EightPuzzleDistances.UNKNOWN
+        powers = [9 ** i for i in range( len(self.pattern) )]
+        distances = array.array('B', [unknown]) * self.size
+        start = sum([number * power for number, power in zip(self.pattern, powers)])
+        queue = collections.deque([(0, start, 0)])
+        while queue:
+            depth, index, blank = queue.popleft()
+            if distances[index * 9 + blank] != unknown: continue
+            distances[index * 9 + blank] = depth
+            cells = [(index / power) % 9 for power in powers]
+            for move, target in MOVE_TARGETS[blank]:
+                if target in cells:
+                    # One of the pattern's numbers slides into the blank
+                    moved = cells.index(target)
+                    child = index + (blank - target) * powers[moved]
+                    if distances[child * 9 + target] == unknown: queue.append((depth + 1, child, target))
+                elif distances[index * 9 + target] == unknown:
+                    queue.appendleft((depth, index, target))
+        return distances
+
+    def getIndex(self, cells):
+        "Returns the index of the pattern's numbers and the blank, given the cell of every number."
+        index = 0
+        for number in reversed(self.pattern):
+            index = index * 9 + cells[number]
+        return index * 9 + cells[0]
+
+    def getDistance(self, state):
+        return self.distances[self.getIndex(getCellsOfNumbers(state))]
+
+def getCellsOfNumbers(state):
+    "Returns a list of the cell each number is in."
+    code = state.code
+    cells = [0] * 9
+    for cell in range( 9 ):
+        cells[(code >> (4 * cell)) & 15] = cell
+    return cells
+
+def loadTable(fileName, size):
+    """
+      Reads a table of size bytes from fileName, or returns None if it is
+    missing or the wrong size.
+    """
+    table = array.array('B')
+    try:
+        f = open(fileName, 'rb')
+        try: table.fromfile(f, size)
+        finally: f.close()
+    except (IOError, EOFError):
+        return None
+    return table
+
+def saveTable(fileName, table):
+    """
+      Writes a table to fileName.  The file is renamed into place, so
+    concurrent runs never see a partial table.  Failing to write is not
+    an error, the table is just computed again next time.
+    """
+    try:
+        cacheDir = os.path.dirname(fileName)
+        if not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+        tmpName = '%s.%d.tmp' % (fileName, os.getpid())
+        f = open(tmpName, 'wb')
+        try: table.tofile(f)
+        finally: f.close()
+        os.rename(tmpName, fileName)
+    except (IOError, OSError):
+        pass
+
+DEFAULT_PATTERNS = [(1, 2, 3, 4), (5, 6, 7, 8)]
+
+_distances = None
+_patternDatabases = {}
+
+def getEightPuzzleDistances():
+    "Returns the EightPuzzleDistances, loading or computing them the first time."
+    global _distances
+    if _distances == None: _distances = EightPuzzleDistances()
+    return _distances
+
+def getPatternDatabases(patterns=DEFAULT_PATTERNS):
+    "Returns a PatternDatabase for each of patterns, loading or computing them the first time."
+    for pattern in patterns:
+        if tuple(pattern) not in _patternDatabases:
+            _patternDatabases[tuple(pattern)] = PatternDatabase(pattern)
+    return [_patternDatabases[tuple(pattern)] for pattern in patterns]
+
+def eightPuzzlePatternHeuristic(state, problem=None):
+    """
+      An admissible heuristic for EightPuzzleSearchProblem, for use with
+    search.aStarSearch: the sum of the pattern databases of the numbers 1
+    to 4 and 5 to 8.
+    """
+    cells = getCellsOfNumbers(state)
+    return sum([database.distances[database.getIndex(cells)] for database in getPatternDatabases()])
+
+def eightPuzzleDistanceHeuristic(state, problem=None):
+    """
+      The perfect heuristic for EightPuzzleSearchProblem: the exact number
+    of moves left, looked up in the EightPuzzleDistances, or infinity for a
+    puzzle that can't be solved.
+    """
+    distance = getEightPuzzleDistances().getDistance(state)
+    if distance == None: return float('inf')
+    return distance
+
 if __name__ == '__main__':
     puzzle = createRandomEightPuzzle(25)
     print('A random puzzle:')
@@ -21,7 +21,7 @@
 # For more info, see http://inst.eecs.berkeley.edu/~cs188/sp09/pacman.html
 
 from util import *
-import time, os
+import time, os, random
 import traceback
 import sys
 
@@ -67,14 +67,18 @@ class Directions:
                WEST: EAST,
                STOP: STOP}
 
-class Configuration:
+class Configuration(object):
     """
     A Configuration holds the (x,y) coordinate of a character, along with its
     traveling direction.
 
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
+
+    Configurations are shared between the states of a game, so they are never
+    changed: moving makes a new one (see generateSuccessor).
     """
+    __slots__ = ('pos', 'direction')
 
     def __init__(self, pos, direction):
         self.pos = pos
@@ -117,10 +121,11 @@ class Configuration:
             direction = self.direction # There is no stop direction
         return Configuration((x + dx, y+dy), direction)
 
-class AgentState:
+class AgentState(object):
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
 
     def __init__( self, startConfiguration, isPacman ):
         self.start = startConfiguration
@@ -183,6 +188,14 @@ class Grid:
     def __setitem__(self, key, item):
         self.data[key] = item
 
+    def get(self, x, y):
+        "Returns grid[x][y], as BitGrid.get does."
+        return self.data[x][y]
+
+    def set(self, x, y, value):
+        "Sets grid[x][y] to value, as BitGrid.set does."
+        self.data[x][y] = value
+
     def __str__(self):
         out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
         out.reverse()
@@ -190,6 +203,9 @@ class Grid:
 
     def __eq__(self, other):
         if other == None: return False
+        if type(self.data[0]) != type(other.data[0]):
+            # One of the grids is frozen
+            return map(list, self.data) == map(list, other.data)
         return self.data == other.data
 
     def __hash__(self):
@@ -205,7 +221,7 @@ class Grid:
 
     def copy(self):
         g = Grid(self.width, self.height)
-        g.data = [x[:] for x in self.data]
+        g.data = [list(x) for x in self.data]
         return g
 
     def deepCopy(self):
@@ -219,6 +235,13 @@ class Grid:
     def count(self, item =True ):
         return sum([x.count(item) for x in self.data])
 
+    def freeze(self):
+        """
+        Makes the grid read-only, so that it can safely be shared: setting
+        grid[x][y] raises a TypeError from then on.  Copies can still be changed.
+        """
+        self.data = [tuple(x) for x in self.data]
+
     def asList(self, key = True):
         list = []
         for x in range(self.width):
@@ -274,12 +297,182 @@ class Grid:
                 bools.append(False)
         return bools
 
+class BitGrid:
+    """
+    A Grid backed by the bits of a single int instead of a list of lists, with
+    the same grid[x][y] interface.  The cell (x, y) is bit x * height + y, which
+    is also the int that Grid.__hash__ builds, so the two hash alike.
+
+    Ints are immutable, so copy() just shares the bits and costs nothing until
+    one of the copies is changed.  Hashing, count and asList work on whole words
+    rather than visiting every cell, which makes this the better choice for
+    grids that are copied, hashed and counted far more than they are read, like
+    the food grid.
+    """
+    def __init__(self, width, height, initialValue=False, bitRepresentation=None):
+        if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
+        self.CELLS_PER_INT = 30
+
+        self.width = width
+        self.height = height
+        self.bits = 0
+        if initialValue:
+            self.bits = (1 << (width * height)) - 1
+        if bitRepresentation:
+            self._unpackBits(bitRepresentation)
+
+    def __getitem__(self, i):
+        if i < 0: i += self.width
+        if not 0 <= i < self.width: raise IndexError('grid index out of range')
+        return _BitGridColumn(self, i)
+
+    def __setitem__(self, key, item):
+        column = self[key]
+        for y in range(self.height):
+            column[y] = item[y]
+
+    def get(self, x, y):
+        """
+        Returns grid[x][y] without making the column object grid[x] on the way,
+        for loops that read a lot of cells.
+        """
+        if x < 0: x += self.width
+        if y < 0: y += self.height
+        if not (0 <= x < self.width and 0 <= y < self.height): raise IndexError('grid index out of range')
+        return (self.bits >> (x * self.height + y)) & 1 == 1
+
+    def set(self, x, y, value):
+        "Sets grid[x][y] to value, without making a column object either."
+        if x < 0: x += self.width
+        if y < 0: y += self.height
+        if not (0 <= x < self.width and 0 <= y < self.height): raise IndexError('grid index out of range')
+        if value:
+            self.bits |= 1 << (x * self.height + y)
+        else:
+            self.bits &= ~(1 << (x * self.height + y))
+
+    def __str__(self):
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out.reverse()
+        return '\n'.join([''.join(x) for x in out])
+
+    def __eq__(self, other):
+        if other == None: return False
+        if isinstance(other, BitGrid):
+            return self.bits == other.bits and self.width == other.width and self.height == other.height
+        return self.width == other.width and self.height == other.height and self.asList() == other.asList()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def copy(self):
+        g = BitGrid(self.width, self.height)
+        g.bits = self.bits
+        return g
+
+    def deepCopy(self):
+        return self.copy()
+
+    def shallowCopy(self):
+        # There is nothing to share but the bits, so this is the same as copy:
+        # changing one grid never changes the other.
+        return self.copy()
+
+    def count(self, item =True ):
+        ones = bin(self.bits).count('1')
+        if item: return ones
+        return self.width * self.height - ones
+
+    def asList(self, key = True):
+        bits = self.bits
+        if not key:
+            bits = ~bits & ((1 << (self.width * self.height)) - 1)
+        list = []
+        while bits:
+            lowest = bits & -bits
+            list.append(divmod(lowest.bit_length() - 1, self.height))
+            bits ^= lowest
+        return list
+
+    def packBits(self):
+        """
+        Returns an efficient int list representation, the same as Grid.packBits
+
+        (width, height, bitPackedInts...)
+        """
+        bits = [self.width, self.height]
+        mask = (1 << self.CELLS_PER_INT) - 1
+        for i in range(self.width * self.height / self.CELLS_PER_INT + 1):
+            chunk = (self.bits >> (i * self.CELLS_PER_INT)) & mask
+            # Grid.packBits puts the first cell of each int in its highest bit
+            bits.append(int(format(chunk, '0%db' % self.CELLS_PER_INT)[::-1], 2))
+        return tuple(bits)
+
+    def _unpackBits(self, bits):
+        """
+        Fills in data from a bit-level representation
+        """
+        self.bits = 0
+        for i, packed in enumerate(bits):
+            if packed < 0: raise ValueError, "must be a positive integer"
+            chunk = int(format(packed, '0%db' % self.CELLS_PER_INT)[::-1], 2)
+            self.bits |= chunk << (i * self.CELLS_PER_INT)
+        self.bits &= (1 << (self.width * self.height)) - 1
+
+class _BitGridColumn:
+    """
+    The column grid[x] of a BitGrid, reading and writing the grid's bits.
+    """
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.offset = x * grid.height
+
+    def __getitem__(self, y):
+        if y < 0: y += self.grid.height
+        if not 0 <= y < self.grid.height: raise IndexError('grid index out of range')
+        return (self.grid.bits >> (self.offset + y)) & 1 == 1
+
+    def __setitem__(self, y, value):
+        if y < 0: y += self.grid.height
+        if not 0 <= y < self.grid.height: raise IndexError('grid index out of range')
+        if value:
+            self.grid.bits |= 1 << (self.offset + y)
+        else:
+            self.grid.bits &= ~(1 << (self.offset + y))
+
+    def __len__(self):
+        return self.grid.height
+
 def reconstituteGrid(bitRep):
     if type(bitRep) is not type((1,2)):
         return bitRep
     width, height = bitRep[:2]
     return Grid(width, height, bitRepresentation= bitRep[2:])
 
+def gridAdjacency(walls):
+    """
+    Builds the graph of the open cells of a wall Grid in a single pass.
+
+    Returns a dict mapping each open (x,y) to a tuple of its open 4-neighbours,
+    in North, South, East, West order.
+    """
+    adjacency = {}
+    width, height = walls.width, walls.height
+    for x in range(width):
+        column = walls[x]
+        for y in range(height):
+            if column[y]: continue
+            neighbors = []
+            if y + 1 < height and not column[y + 1]: neighbors.append((x, y + 1))
+            if y > 0 and not column[y - 1]: neighbors.append((x, y - 1))
+            if x + 1 < width and not walls[x + 1][y]: neighbors.append((x + 1, y))
+            if x > 0 and not walls[x - 1][y]: neighbors.append((x - 1, y))
+            adjacency[(x, y)] = tuple(neighbors)
+    return adjacency
+
 ####################################
 # Parts you shouldn't have to read #
 ####################################
@@ -348,6 +541,21 @@ class Actions:
 
     getPossibleActions = staticmethod(getPossibleActions)
 
+    def ghostActions(possibleActions, heading):
+        """
+        Returns the actions a ghost heading in a direction may take, out of those
+        possible: ghosts cannot stop, and cannot turn around unless they reach a
+        dead end.
+        """
+        actions = list(possibleActions)
+        reverse = Actions.reverseDirection(heading)
+        if Directions.STOP in actions:
+            actions.remove(Directions.STOP)
+        if reverse in actions and len(actions) > 1:
+            actions.remove(reverse)
+        return actions
+    ghostActions = staticmethod(ghostActions)
+
     def getLegalNeighbors(position, walls):
         x,y = position
         x_int, y_int = int(x + 0.5), int(y + 0.5)
@@ -368,21 +576,50 @@ class Actions:
         return (x + dx, y + dy)
     getSuccessor = staticmethod(getSuccessor)
 
-class GameStateData:
+ZOBRIST_KEYS = {}
+
+def zobristKey(part):
+    """
+    Returns the random 63 bit key of one part of a game state, such as
+    ('food', x, y).  Keys are seeded by the part itself, so they are the same
+    in every run and every process, and making them never touches the random
+    numbers the game is played with.
     """
+    if part not in ZOBRIST_KEYS:
+        ZOBRIST_KEYS[part] = random.Random(('zobrist',) + part).getrandbits(63)
+    return ZOBRIST_KEYS[part]
 
+class GameStateData(object):
+    """
+    The data of a GameState.  Besides the food, capsules, agents and score, it
+    keeps a Zobrist key of the food, capsules and agents, the XOR of the
+    zobristKey of each, which the game rules update as they change things so
+    that hashing a state takes constant time.  Anything else that changes the
+    data in place must do the same (see the toggle methods), or set _zobrist
+    to None to have it worked out again.
+
+    A new GameStateData made from a predecessor shares its capsule list and
+    AgentStates, so the rules replace those rather than change them in place:
+    see updateAgentState.  deepCopy makes copies that share nothing that can
+    change.
     """
+    __slots__ = ('food', 'capsules', 'agentStates', 'layout', '_eaten', 'score', '_zobrist', '_foodEaten',
+                 '_foodAdded', '_capsuleEaten', '_agentMoved', '_lose', '_win', 'scoreChange')
+
     def __init__( self, prevState = None ):
         """
         Generates a new data packet by copying information from its predecessor.
         """
         if prevState != None:
             self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
             self.score = prevState.score
+            self._zobrist = prevState._zobrist
+        else:
+            self._zobrist = None
 
         self._foodEaten = None
         self._foodAdded = None
@@ -395,13 +632,25 @@ class GameStateData:
     def deepCopy( self ):
         state = GameStateData( self )
         state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        # Layouts never change, so every copy shares the same one
+        state.layout = self.layout
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
         state._capsuleEaten = self._capsuleEaten
         return state
 
+    def updateAgentState( self, index ):
+        """
+        Returns the AgentState of agent index, ready to be changed: it is first
+        replaced by a copy, as it may be shared with other states.
+        """
+        agentState = self.agentStates[index].copy()
+        self.agentStates[index] = agentState
+        return agentState
+
     def copyAgentStates( self, agentStates ):
         copiedStates = []
         for agentState in agentStates:
@@ -414,6 +663,7 @@ class GameStateData:
         """
         if other == None: return False
         # TODO Check for type of other
+        if not self.getZobristKey() == other.getZobristKey(): return False
         if not self.agentStates == other.agentStates: return False
         if not self.food == other.food: return False
         if not self.capsules == other.capsules: return False
@@ -424,13 +674,45 @@ class GameStateData:
         """
         Allows states to be keys of dictionaries.
         """
-        for i, state in enumerate( self.agentStates ):
-            try:
-                int(hash(state))
-            except TypeError, e:
-                print e
-                #hash(state)
-        return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113* hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575 )
+        return hash(self.getZobristKey() ^ hash(self.score))
+
+    def getZobristKey( self ):
+        """
+        Returns the Zobrist key of the food, capsules and agents.
+        """
+        if self._zobrist == None:
+            key = 0
+            for x, y in self.food.asList(): key ^= zobristKey(('food', x, y))
+            for x, y in self.capsules: key ^= zobristKey(('capsule', x, y))
+            for index in range(len(self.agentStates)): key ^= self.agentKey(index)
+            self._zobrist = key
+        return self._zobrist
+
+    def agentKey( self, index ):
+        agentState = self.agentStates[index]
+        configuration = agentState.configuration
+        if configuration == None: return zobristKey(('agent', index, None, None))
+        return zobristKey(('agent', index, configuration.pos, configuration.direction)) ^ \
+               zobristKey(('timer', index, agentState.scaredTimer))
+
+    def toggleAgentKey( self, index ):
+        """
+        Takes an agent's configuration and scared timer out of the Zobrist key,
+        or puts them back in: call it before and after changing them.
+        """
+        if self._zobrist != None: self._zobrist ^= self.agentKey(index)
+
+    def toggleFoodKey( self, position ):
+        """
+        Takes food at position out of the Zobrist key, or puts it back in.
+        """
+        if self._zobrist != None: self._zobrist ^= zobristKey(('food',) + tuple(position))
+
+    def toggleCapsuleKey( self, position ):
+        """
+        Takes a capsule at position out of the Zobrist key, or puts it back in.
+        """
+        if self._zobrist != None: self._zobrist ^= zobristKey(('capsule',) + tuple(position))
 
     def __str__( self ):
         width, height = self.layout.width, self.layout.height
@@ -440,7 +722,7 @@ class GameStateData:
         for x in range(width):
             for y in range(height):
                 food, walls = self.food, self.layout.walls
-                map[x][y] = self._foodWallStr(food[x][y], walls[x][y])
+                map[x][y] = self._foodWallStr(food.get(x, y), walls[x][y])
 
         for agentState in self.agentStates:
             if agentState == None: continue
@@ -503,6 +785,8 @@ class GameStateData:
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
         self._eaten = [False for a in self.agentStates]
+        self._zobrist = None
+        self.getZobristKey()
 
 try:
     import boinc
@@ -515,7 +799,7 @@ class Game:
     The Game manages the control flow, soliciting actions from agents.
     """
 
-    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False ):
+    def __init__( self, agents, display, rules, startingIndex=0, muteAgents=False, catchExceptions=False, turbo=True ):
         self.agentCrashed = False
         self.agents = agents
         self.display = display
@@ -524,7 +808,9 @@ class Game:
         self.gameOver = False
         self.muteAgents = muteAgents
         self.catchExceptions = catchExceptions
+        self.turbo = turbo
         self.moveHistory = []
+        self.recorder = None
         self.totalAgentTimes = [0 for agent in agents]
         self.totalAgentTimeWarnings = [0 for agent in agents]
         self.agentTimeout = False
@@ -564,10 +850,33 @@ class Game:
         sys.stderr = OLD_STDERR
 
 
+    def isTurbo( self ):
+        """
+        Whether run can take the turbo path: the agents are trusted, so none
+        of their exceptions are caught or output muted, and nothing is drawn.
+        """
+        if not self.turbo or self.catchExceptions or self.muteAgents: return False
+        checkNullDisplay = getattr(self.display, 'checkNullDisplay', None)
+        return checkNullDisplay != None and checkNullDisplay()
+
     def run( self ):
         """
         Main control loop for game play.
         """
+        if self.isTurbo(): return self.runTurbo()
+        if not self.catchExceptions: return self.runTimed()
+        # One budget times every call to the agents for the whole game
+        self.budget = TimeBudget()
+        self.budget.start()
+        try:
+            self.runTimed()
+        finally:
+            self.budget.stop()
+
+    def runTimed( self ):
+        """
+        The control loop of run, timing the agents if exceptions are caught.
+        """
         self.display.initialize(self.state.data)
         self.numMoves = 0
 
@@ -587,11 +896,10 @@ class Game:
                 self.mute(i)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
                         try:
-                            start_time = time.time()
-                            timed_func(self.state.deepCopy())
-                            time_taken = time.time() - start_time
+                            start_time = monotonicTime()
+                            self.budget.call(self.rules.getMaxStartupTime(i), agent.registerInitialState, self.state.deepCopy())
+                            time_taken = monotonicTime() - start_time
                             self.totalAgentTimes[i] += time_taken
                         except TimeoutFunctionException:
                             print >>sys.stderr, "Agent %d ran out of time on startup!" % i
@@ -621,13 +929,12 @@ class Game:
                 self.mute(agentIndex)
                 if self.catchExceptions:
                     try:
-                        timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
                         try:
-                            start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
+                            start_time = monotonicTime()
+                            observation = self.budget.call(self.rules.getMoveTimeout(agentIndex), agent.observationFunction, self.state.deepCopy())
                         except TimeoutFunctionException:
                             skip_action = True
-                        move_time += time.time() - start_time
+                        move_time += monotonicTime() - start_time
                         self.unmute()
                     except Exception,data:
                         self._agentCrash(agentIndex, quiet=False)
@@ -644,12 +951,11 @@ class Game:
             self.mute(agentIndex)
             if self.catchExceptions:
                 try:
-                    timed_func = TimeoutFunction(agent.getAction, int(self.rules.getMoveTimeout(agentIndex)) - int(move_time))
                     try:
-                        start_time = time.time()
+                        start_time = monotonicTime()
                         if skip_action:
                             raise TimeoutFunctionException()
-                        action = timed_func( observation )
+                        action = self.budget.call(self.rules.getMoveTimeout(agentIndex) - move_time, agent.getAction, observation)
                     except TimeoutFunctionException:
                         print >>sys.stderr, "Agent %d timed out on a single move!" % agentIndex
                         self.agentTimeout = True
@@ -657,7 +963,7 @@ class Game:
                         self.unmute()
                         return
 
-                    move_time += time.time() - start_time
+                    move_time += monotonicTime() - start_time
 
                     if move_time > self.rules.getMoveWarningTime(agentIndex):
                         self.totalAgentTimeWarnings[agentIndex] += 1
@@ -698,6 +1004,7 @@ class Game:
                     return
             else:
                 self.state = self.state.generateSuccessor( agentIndex, action )
+            if self.recorder: self.recorder.record( agentIndex, action, self.state )
 
             # Change the display
             self.display.update( self.state.data )
@@ -727,3 +1034,43 @@ class Game:
                     self.unmute()
                     return
         self.display.finish()
+
+    def runTurbo( self ):
+        """
+        The control loop of run for trusted agents and a null display.
+
+        Looks each agent's protocol up once at the start and then plays
+        exactly the moves run would, without the muting, timing and display
+        calls it makes every turn.
+        """
+        self.numMoves = 0
+        agents = self.agents
+        for i in range(len(agents)):
+            if not agents[i]:
+                print >>sys.stderr, "Agent %d failed to load" % i
+                self._agentCrash(i, quiet=True)
+                return
+            if "registerInitialState" in dir(agents[i]):
+                agents[i].registerInitialState(self.state.deepCopy())
+
+        observers = [getattr(agent, 'observationFunction', None) for agent in agents]
+        getActions = [agent.getAction for agent in agents]
+        moveHistory = self.moveHistory
+        recorder = self.recorder
+        process = self.rules.process
+        agentIndex = self.startingIndex
+        numAgents = len(agents)
+
+        while not self.gameOver:
+            observer = observers[agentIndex]
+            if observer: observation = observer(self.state.deepCopy())
+            else: observation = self.state.deepCopy()
+            action = getActions[agentIndex](observation)
+            moveHistory.append( (agentIndex, action) )
+            self.state = self.state.generateSuccessor( agentIndex, action )
+            if recorder: recorder.record( agentIndex, action, self.state )
+            process(self.state, self)
+            agentIndex = ( agentIndex + 1 ) % numAgents
+
+        for agent in agents:
+            if "final" in dir( agent ): agent.final( self.state )
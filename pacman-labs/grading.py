@@ -15,22 +15,30 @@
 "Common code for autograders"
 
 import cgi
+import math
+import multiprocessing
+import os
+import select
+import signal
 import time
 import sys
 import json
 import traceback
 import pdb
 from collections import defaultdict
+from collections import deque
 import util
 
 class Grades:
   "A data structure for project grades, along with formatting code to display them"
   def __init__(self, projectName, questionsAndMaxesList,
-               gsOutput=False, edxOutput=False, muteOutput=False):
+               gsOutput=False, edxOutput=False, muteOutput=False, timeout=1800):
     """
     Defines the grading scheme for a project
       projectName: project name
       questionsAndMaxesDict: a list of (question name, max points per question)
+      timeout: seconds each question may take, or None when the test cases
+               run in a WorkerPool that limits them itself
     """
     self.questions = [el[0] for el in questionsAndMaxesList]
     self.maxes = dict(questionsAndMaxesList)
@@ -44,6 +52,7 @@ class Grades:
     self.gsOutput = gsOutput  # GradeScope output
     self.mute = muteOutput
     self.prereqs = defaultdict(set)
+    self.timeout = timeout
 
     #print 'Autograder transcript for %s' % self.project
     print 'Starting on %d-%d at %d:%02d:%02d' % self.start
@@ -75,8 +84,13 @@ class Grades:
 
       if self.mute: util.mutePrint()
       try:
-        util.TimeoutFunction(getattr(gradingModule, q),1800)(self) # Call the question's function
+        if self.timeout != None:
+          util.TimeoutFunction(getattr(gradingModule, q),self.timeout)(self) # Call the question's function
+        else:
+          getattr(gradingModule, q)(self)
         #TimeoutFunction(getattr(gradingModule, q),1200)(self) # Call the question's function
+      except WorkerTerminated, inst:
+        self.fail('FAIL: %s' % inst)
       except Exception, inst:
         self.addExceptionMessage(q, inst, traceback)
         self.addErrorHints(exceptionMap, inst, q[1])
@@ -148,11 +162,18 @@ to follow your instructor's guidelines to receive credit on your project.
     """
     self.fail('FAIL: Exception raised: %s' % inst)
     self.addMessage('')
-    for line in traceback.format_exc().split('\n'):
+    if isinstance(inst, WorkerException):
+      text = inst.tracebackText
+    else:
+      text = traceback.format_exc()
+    for line in text.split('\n'):
         self.addMessage(line)
 
   def addErrorHints(self, exceptionMap, errorInstance, questionNum):
-    typeOf = str(type(errorInstance))
+    if isinstance(errorInstance, WorkerException):
+      typeOf = errorInstance.typeName
+    else:
+      typeOf = str(type(errorInstance))
     questionName = 'q' + questionNum
     errorHint = ''
 
@@ -302,9 +323,243 @@ to follow your instructor's guidelines to receive credit on your project.
       #self.messages[self.currentQuestion].append(line)
 
 
+class GradesRecorder:
+  """
+  Stands in for Grades while a test case runs in another process.
+
+  Every call a test case makes on its grades, and everything it prints, is
+  recorded in order, so that replay can later make the same calls on the real
+  Grades and produce exactly the output running the test there would have.
+  """
+  def __init__(self):
+    self.calls = []
+
+  def replay(self, grades):
+    for name, args in self.calls:
+      if name == 'write':
+        sys.stdout.write(*args)
+      else:
+        getattr(grades, name)(*args)
+
+  def write(self, text):
+    "Records printed text, so that the recorder can stand in for sys.stdout."
+    self.calls.append(('write', (text,)))
+
+  def flush(self):
+    pass
+
+  def fail(self, message, raw=False):
+    self.calls.append(('fail', (message, raw)))
+
+  def assignZeroCredit(self):
+    self.calls.append(('assignZeroCredit', ()))
+
+  def addPoints(self, amt):
+    self.calls.append(('addPoints', (amt,)))
+
+  def deductPoints(self, amt):
+    self.calls.append(('deductPoints', (amt,)))
+
+  def assignFullCredit(self, message="", raw=False):
+    self.calls.append(('assignFullCredit', (message, raw)))
+
+  def addMessage(self, message, raw=False):
+    self.calls.append(('addMessage', (message, raw)))
+
+  def addMessageToEmail(self, message):
+    self.calls.append(('addMessageToEmail', (message,)))
+
 
 
 
+class WorkerException(Exception):
+  """
+  Raised in the grader in place of an exception that a test case raised in a
+  worker process, carrying the type and traceback of the original.
+  """
+  def __init__(self, message, typeName, tracebackText):
+    Exception.__init__(self, message)
+    self.typeName = typeName
+    self.tracebackText = tracebackText
+
+class WorkerTerminated(Exception):
+  "Raised in the grader when a test case ends its worker process, or is stopped for overrunning."
+  pass
+
+def describeException():
+  """
+  Returns the type, message and traceback of the exception being handled, so
+  that they can be sent to another process and raised as a WorkerException.
+  """
+  excType, inst, tb = sys.exc_info()
+  return str(excType), str(inst), traceback.format_exc()
+
+def runWorker(conn, function, cpuLimit, memoryLimit):
+  """
+  The main loop of a WorkerPool process.  Calls function with each key it is
+  sent, with cpuLimit more seconds of CPU time, and sends back ('ok', what it
+  returned) or ('error', describeException()).
+  """
+  # interrupts are for the grader to deal with
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  if cpuLimit != None or memoryLimit != None:
+    import resource
+  if memoryLimit != None:
+    resource.setrlimit(resource.RLIMIT_AS, (memoryLimit, memoryLimit))
+  if cpuLimit != None:
+    # running out of CPU time kills the worker, without leaving a core file
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    signal.signal(signal.SIGXCPU, signal.SIG_DFL)
+  while True:
+    try:
+      key = conn.recv()
+    except EOFError:
+      return
+    if cpuLimit != None:
+      usage = resource.getrusage(resource.RUSAGE_SELF)
+      soft = int(math.ceil(usage.ru_utime + usage.ru_stime + cpuLimit))
+      hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+      if hard != resource.RLIM_INFINITY: soft = min(soft, hard)
+      resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+    try:
+      message = ('ok', function(key))
+    except Exception:
+      message = ('error', describeException())
+    try:
+      conn.send(message)
+    except Exception:
+      # what the call returned can't be pickled
+      conn.send(('error', describeException()))
+
+class WorkerPool:
+  """
+  A pool of worker processes that call a function for the grader with one key
+  at a time each, and send back what it returns over a pipe.
+
+  The workers are forked when the pool starts, so they have everything the
+  grader had then, and they are kept warm from one key to the next.  Each call
+  may use cpuLimit seconds of CPU time, and twice that in wall clock time in
+  case it is blocked rather than busy, and each worker may use memoryLimit
+  bytes of address space, including what it shares with the grader.  Without
+  a cpuLimit, each call may still take wallLimit seconds, so that nothing runs
+  forever.  A call that overruns costs only its own budget: its worker is
+  killed and replaced, and the other workers carry on.
+  """
+  def __init__(self, numWorkers, function, cpuLimit=None, memoryLimit=None, wallLimit=1800):
+    self.numWorkers = numWorkers
+    self.function = function
+    self.cpuLimit = cpuLimit
+    self.memoryLimit = memoryLimit
+    self.wallLimit = wallLimit
+    if cpuLimit != None:
+      self.wallLimit = 2 * cpuLimit + 1
+    self.pending = deque()
+    self.idle = []
+    self.busy = {}
+    self.results = {}
+
+  def isLimited(self):
+    return self.cpuLimit != None or self.memoryLimit != None
+
+  def start(self):
+    for i in range(self.numWorkers):
+      self.idle.append(self.spawn())
+
+  def spawn(self):
+    conn, childConn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=runWorker, args=(childConn, self.function, self.cpuLimit, self.memoryLimit))
+    process.daemon = True
+    process.start()
+    childConn.close()
+    return process, conn
+
+  def submit(self, key):
+    "Queues a call with key to run on the next free worker."
+    self.pending.append(key)
+    self.dispatch()
+
+  def dispatch(self):
+    while self.pending and self.idle:
+      worker = self.idle.pop()
+      key = self.pending[0]
+      try:
+        worker[1].send(key)
+      except IOError:
+        # the worker has gone, so the key waits for its replacement
+        self.idle.append(self.replace(worker))
+        continue
+      self.pending.popleft()
+      self.busy[worker] = (key, time.time() + self.wallLimit)
+
+  def get(self, key):
+    """
+    Waits for the call with key to finish, and returns what it returned.
+    Raises a WorkerException if it raised, and WorkerTerminated if its worker
+    ended or was stopped before it finished.
+    """
+    while key not in self.results:
+      self.wait()
+    result = self.results.pop(key)
+    if isinstance(result, Exception): raise result
+    return result
+
+  def wait(self):
+    "Waits up to a second for busy workers to finish, and stops any that have overrun."
+    if not self.busy:
+      raise Exception('Nothing is running')
+    ready = select.select([conn for process, conn in self.busy], [], [], 1.0)[0]
+    now = time.time()
+    for worker in self.busy.keys():
+      process, conn = worker
+      key, deadline = self.busy[worker]
+      if conn in ready:
+        try:
+          status, value = conn.recv()
+        except (EOFError, IOError):
+          self.terminated(worker, self.describeExit(process))
+          continue
+        if status == 'ok':
+          self.results[key] = value
+        else:
+          self.results[key] = WorkerException(value[1], value[0], value[2])
+        del self.busy[worker]
+        self.idle.append(worker)
+      elif now > deadline:
+        os.kill(process.pid, signal.SIGKILL)
+        self.terminated(worker, 'Terminated after taking more than %gs.' % self.wallLimit)
+      elif not process.is_alive():
+        self.terminated(worker, self.describeExit(process))
+    self.dispatch()
+
+  def terminated(self, worker, message):
+    key, deadline = self.busy.pop(worker)
+    self.results[key] = WorkerTerminated(message)
+    self.idle.append(self.replace(worker))
+
+  def replace(self, worker):
+    process, conn = worker
+    process.join()
+    conn.close()
+    return self.spawn()
+
+  def describeExit(self, process):
+    process.join()
+    if process.exitcode == -signal.SIGXCPU:
+      return 'Terminated after using more than %gs of CPU time.' % self.cpuLimit
+    if process.exitcode == -signal.SIGKILL:
+      return 'Terminated by the operating system.'
+    return 'Terminated with exit code %s.' % process.exitcode
+
+  def close(self):
+    for process, conn in self.idle + self.busy.keys():
+      if process.is_alive():
+        os.kill(process.pid, signal.SIGKILL)
+      process.join()
+      conn.close()
+    self.idle = []
+    self.busy = {}
+
+
 class Counter(dict):
   """
   Dict with default 0
@@ -13,53 +13,90 @@
 
 
 from util import manhattanDistance
+from util import nearestPoint
 from game import Grid
+from game import BitGrid
+from game import gridAdjacency
+import array
+import hashlib
 import os
 import random
 
 VISIBILITY_MATRIX_CACHE = {}
+MAZE_DISTANCE_CACHE = {}
+MOVE_TABLE_CACHE = {}
+MAZE_DISTANCE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.distances')
 
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    Layouts are not changed once they are built, so game states share them
+    rather than copying them.  The walls are frozen to keep it that way, and
+    the food and capsules are copied into the state of each new game.
     """
 
     def __init__(self, layoutText):
         self.width = len(layoutText[0])
         self.height= len(layoutText)
         self.walls = Grid(self.width, self.height, False)
-        self.food = Grid(self.width, self.height, False)
+        self.food = BitGrid(self.width, self.height, False)
         self.capsules = []
         self.agentPositions = []
         self.numGhosts = 0
         self.processLayoutText(layoutText)
+        self.walls.freeze()
         self.layoutText = layoutText
         self.totalFood = len(self.food.asList())
-        # self.initializeVisibilityMatrix()
+        self.visibility = None
+        self.mazeDistances = None
+        self.moveTables = None
 
     def getNumGhosts(self):
         return self.numGhosts
 
-    def initializeVisibilityMatrix(self):
+    def getVisibility(self):
+        """
+        Returns the Visibility of this layout, shared by every layout with the same text.
+        """
         global VISIBILITY_MATRIX_CACHE
-        if reduce(str.__add__, self.layoutText) not in VISIBILITY_MATRIX_CACHE:
-            from game import Directions
-            vecs = [(-0.5,0), (0.5,0),(0,-0.5),(0,0.5)]
-            dirs = [Directions.NORTH, Directions.SOUTH, Directions.WEST, Directions.EAST]
-            vis = Grid(self.width, self.height, {Directions.NORTH:set(), Directions.SOUTH:set(), Directions.EAST:set(), Directions.WEST:set(), Directions.STOP:set()})
-            for x in range(self.width):
-                for y in range(self.height):
-                    if self.walls[x][y] == False:
-                        for vec, direction in zip(vecs, dirs):
-                            dx, dy = vec
-                            nextx, nexty = x + dx, y + dy
-                            while (nextx + nexty) != int(nextx) + int(nexty) or not self.walls[int(nextx)][int(nexty)] :
-                                vis[x][y][direction].add((nextx, nexty))
-                                nextx, nexty = x + dx, y + dy
-            self.visibility = vis
-            VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)] = vis
-        else:
-            self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
+        if self.visibility == None:
+            key = '\n'.join(self.layoutText)
+            if key not in VISIBILITY_MATRIX_CACHE:
+                VISIBILITY_MATRIX_CACHE[key] = Visibility(self.walls)
+            self.visibility = VISIBILITY_MATRIX_CACHE[key]
+        return self.visibility
+
+    def getMazeDistances(self):
+        """
+        Returns the MazeDistances of this layout, shared by every layout with the same text.
+        """
+        global MAZE_DISTANCE_CACHE
+        if self.mazeDistances == None:
+            key = '\n'.join(self.layoutText)
+            if key not in MAZE_DISTANCE_CACHE:
+                MAZE_DISTANCE_CACHE[key] = MazeDistances(self)
+            self.mazeDistances = MAZE_DISTANCE_CACHE[key]
+        return self.mazeDistances
+
+    def getMoveTables(self):
+        """
+        Returns the MoveTables of this layout, shared by every layout with the same text.
+        """
+        global MOVE_TABLE_CACHE
+        if self.moveTables == None:
+            key = '\n'.join(self.layoutText)
+            if key not in MOVE_TABLE_CACHE:
+                MOVE_TABLE_CACHE[key] = MoveTables(self.walls)
+            self.moveTables = MOVE_TABLE_CACHE[key]
+        return self.moveTables
+
+    def getFingerprint(self):
+        """
+        Returns a 16 byte digest of the layout text, which identifies the
+        layout in recorded games.
+        """
+        return hashlib.md5('\n'.join(self.layoutText)).digest()
 
     def isWall(self, pos):
         x, col = pos
@@ -84,7 +121,7 @@ class Layout:
 
     def isVisibleFrom(self, ghostPos, pacPos, pacDirection):
         row, col = [int(x) for x in pacPos]
-        return ghostPos in self.visibility[row][col][pacDirection]
+        return ghostPos in self.getVisibility().getVisibleCells((row, col), pacDirection)
 
     def __str__(self):
         return "\n".join(self.layoutText)
@@ -128,6 +165,156 @@ class Layout:
         elif layoutChar in  ['1', '2', '3', '4']:
             self.agentPositions.append( (int(layoutChar), (x,y)))
             self.numGhosts += 1
+
+class Visibility:
+    """
+    The squares that can be seen from each open square of a layout looking
+    North, South, East or West: the corridor running straight out from the
+    square up to, but not including, the first wall.
+
+    Looking up the squares seen within a given distance is then a slice of the
+    corridor, and the sets built for each lookup are kept for next time.
+    """
+
+    def __init__(self, walls):
+        from game import Directions
+        vecs = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+        dirs = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST]
+        self.corridors = {}
+        self.visibleCells = {}
+        for x in range(walls.width):
+            for y in range(walls.height):
+                if walls[x][y]: continue
+                for (dx, dy), direction in zip(vecs, dirs):
+                    corridor = []
+                    nextx, nexty = x + dx, y + dy
+                    while 0 <= nextx < walls.width and 0 <= nexty < walls.height and not walls[nextx][nexty]:
+                        corridor.append((nextx, nexty))
+                        nextx, nexty = nextx + dx, nexty + dy
+                    self.corridors[((x, y), direction)] = tuple(corridor)
+
+    def getVisibleCells(self, pos, direction, limit=None):
+        """
+        Returns a frozenset of the squares seen from pos looking in direction,
+        no more than limit squares away (or any distance if limit is None).
+        Nothing is seen looking in the direction STOP, or from inside a wall.
+        """
+        key = (pos, direction, limit)
+        if key not in self.visibleCells:
+            self.visibleCells[key] = frozenset(self.corridors.get((pos, direction), ())[:limit])
+        return self.visibleCells[key]
+
+class MoveTables:
+    """
+    The legal moves from every open square of a layout, worked out once so that
+    the game rules can look them up instead of checking the walls each time.
+
+    actions maps (x, y) to the actions Actions.getPossibleActions allows there,
+    and ghostActions maps ((x, y), heading) to those Actions.ghostActions
+    allows a ghost heading that way.  Both hold tuples, in the same order as
+    the lists those functions return.  Positions between squares, where
+    scared ghosts can be, aren't in the tables: there the only move is to keep
+    going, so the rules work it out directly.
+    """
+
+    def __init__(self, walls):
+        from game import Actions, Configuration, Directions
+        headings = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+        self.actions = {}
+        self.ghostActions = {}
+        for x in range(walls.width):
+            for y in range(walls.height):
+                if walls[x][y]: continue
+                try:
+                    possible = Actions.getPossibleActions(Configuration((x, y), Directions.STOP), walls)
+                except IndexError:
+                    # An open square on the edge of the board, left to the rules
+                    continue
+                self.actions[(x, y)] = tuple(possible)
+                for heading in headings:
+                    self.ghostActions[((x, y), heading)] = tuple(Actions.ghostActions(possible, heading))
+
+class MazeDistances:
+    """
+    The maze distance between every pair of open cells of a layout, found with
+    one breadth first search per cell and stored in a flat array of shorts.
+
+    The table is saved in cacheDir under the hash of the layout text, so later
+    runs on the same layout load it from disk instead of searching again.
+    """
+    UNREACHABLE = 65535
+
+    def __init__(self, layout, cacheDir=MAZE_DISTANCE_CACHE_DIR):
+        self.cells = [(x, y) for x in range(layout.width) for y in range(layout.height) if not layout.walls[x][y]]
+        self.index = dict([(cell, i) for i, cell in enumerate(self.cells)])
+        self.cacheFile = os.path.join(cacheDir, hashlib.sha1('\n'.join(layout.layoutText)).hexdigest() + '.dist')
+        self.distances = self.load()
+        if self.distances is None:
+            self.distances = self.compute(layout.walls)
+            self.save()
+
+    def getDistance(self, pos1, pos2):
+        """
+        Returns the length of the shortest path between two positions, or None if
+        there is no path.  Positions are rounded to the nearest grid point.
+        """
+        distance = self.distances[self.index[nearestPoint(pos1)] * len(self.cells) + self.index[nearestPoint(pos2)]]
+        if distance == MazeDistances.UNREACHABLE: return None
+        return distance
+
+    def compute(self, walls):
+        adjacency = gridAdjacency(walls)
+        neighbors = [[self.index[neighbor] for neighbor in adjacency[cell]] for cell in self.cells]
+        numCells = len(self.cells)
+        distances = array.array('H', [MazeDistances.UNREACHABLE]) * (numCells * numCells)
+        for source in range(numCells):
+            row = source * numCells
+            distances[row + source] = 0
+            frontier = [source]
+            depth = 0
+            while frontier:
+                depth += 1
+                nextFrontier = []
+                for cell in frontier:
+                    for neighbor in neighbors[cell]:
+                        if distances[row + neighbor] == MazeDistances.UNREACHABLE:
+                            distances[row + neighbor] = depth
+                            nextFrontier.append(neighbor)
+                frontier = nextFrontier
+        return distances
+
+    def load(self):
+        """
+        Reads the table from the cache file, or returns None if it is missing or
+        the wrong size.
+        """
+        size = len(self.cells) * len(self.cells)
+        distances = array.array('H')
+        try:
+            f = open(self.cacheFile, 'rb')
+            try: distances.fromfile(f, size)
+            finally: f.close()
+        except (IOError, EOFError):
+            return None
+        return distances
+
+    def save(self):
+        """
+        Writes the table to the cache file.  The file is renamed into place, so
+        concurrent runs never see a partial table.  Failing to write is not an
+        error, the table is just computed again next time.
+        """
+        try:
+            cacheDir = os.path.dirname(self.cacheFile)
+            if not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+            tmpName = '%s.%d.tmp' % (self.cacheFile, os.getpid())
+            f = open(tmpName, 'wb')
+            try: self.distances.tofile(f)
+            finally: f.close()
+            os.rename(tmpName, self.cacheFile)
+        except (IOError, OSError):
+            pass
+
 def getLayout(name, back = 2):
     if name.endswith('.lay'):
         layout = tryToLoad('layouts/' + name)
@@ -142,6 +329,20 @@ def getLayout(name, back = 2):
         os.chdir(curdir)
     return layout
 
+def findLayout(fingerprint, back = 2):
+    """
+    Returns the layout in the layouts directory with the given fingerprint, or
+    None if there isn't one.  Like getLayout, it looks in parent directories
+    too.
+    """
+    for directory in [os.path.join(*(['..'] * up + ['layouts'])) for up in range(back + 2)]:
+        if not os.path.isdir(directory): continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.lay'): continue
+            layout = tryToLoad(os.path.join(directory, name))
+            if layout != None and layout.getFingerprint() == fingerprint: return layout
+    return None
+
 def tryToLoad(fullname):
     if(not os.path.exists(fullname)): return None
     f = open(fullname)